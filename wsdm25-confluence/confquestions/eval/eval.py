@@ -2,7 +2,7 @@ import dataclasses
 import json
 import shutil
 import time
-from typing import List, Optional, Literal, Dict
+from typing import List, Optional, Literal, Dict, TYPE_CHECKING
 from dataclasses import dataclass, field
 from pathlib import Path
 import asyncio
@@ -11,6 +11,9 @@ import re
 import pandas as pd
 from pydantic import TypeAdapter
 
+if TYPE_CHECKING:
+    from completion_cache import CompletionCache
+
 
 """
 DISCLAIMER:
@@ -180,8 +183,13 @@ def contains_document_url(retrieved_documents: List[Document], ground_truth_docu
     }
 
 
-async def run_conversation_benchmark(conv: Conversation, rag: RAG, language_codes: Optional[List[str]] = None, rephrased_from_input: bool = False, delay: float = 1.5,) -> List[BenchmarkConversationResult]:
+async def run_conversation_benchmark(conv: Conversation, rag: RAG, language_codes: Optional[List[str]] = None, rephrased_from_input: bool = False, delay: float = 1.5, completion_cache: Optional["CompletionCache"] = None) -> List[BenchmarkConversationResult]:
     conversation_benchmark_results = []
+    # A replay has to be complete, so its cache misses are raised instead of being reported like other errors
+    fatal_errors = ()
+    if completion_cache is not None:
+        from completion_cache import CompletionCacheMiss
+        fatal_errors = (CompletionCacheMiss,)
     for turn in conv.turns:
         language_codes = language_codes or ["en"]
         for lang_code in language_codes:
@@ -225,7 +233,16 @@ async def run_conversation_benchmark(conv: Conversation, rag: RAG, language_code
                 )
 
                 try:
-                    answer_evaluation = await rag.answer_generation_model.complete_prompt(prompt)
+                    if completion_cache is not None:
+                        # The judge runs with the model's own temperature and max_tokens; they are part of the key, so
+                        # judgments generated with other parameters are not replayed
+                        judge = rag.answer_generation_model
+                        answer_evaluation = await completion_cache.acomplete(
+                            judge.name, getattr(judge, "temperature", None), getattr(judge, "max_tokens", None), prompt,
+                            lambda: judge.complete_prompt(prompt),
+                        )
+                    else:
+                        answer_evaluation = await rag.answer_generation_model.complete_prompt(prompt)
                     answer_evaluation = strip_markdown_code_block(answer_evaluation)
 
                     if answer_evaluation.strip():
@@ -239,6 +256,8 @@ async def run_conversation_benchmark(conv: Conversation, rag: RAG, language_code
                     else:
                         print("Received an empty or whitespace response from the model.")
 
+                except fatal_errors:
+                    raise
                 except Exception as e:
                     print(f"Unexpected error during model evaluation: {e}")
                 document_retrieval_scores = contains_document_url(document_query_result, turn.a_url)
@@ -288,12 +307,13 @@ async def run_document_benchmark(
     languages: Optional[List[str]] = None,
     rephrased_from_input: bool = False,
     delay: float = 0.0,
-    output_filename: Optional[Path] = None
+    output_filename: Optional[Path] = None,
+    completion_cache: Optional["CompletionCache"] = None,
 ) -> Dict[str, List[BenchmarkConversationResult]]:
     results = {}
 
     for conv in data:
-        result = await run_conversation_benchmark(conv, rag, languages, rephrased_from_input, delay)
+        result = await run_conversation_benchmark(conv, rag, languages, rephrased_from_input, delay, completion_cache)
         results[result[0].conv_id] = result
 
         if output_filename:
@@ -422,22 +442,38 @@ def run_benchmark(
     repetitions: int = 1,
     rephrased_from_input: bool = False,
     delay: float = 0.0,
+    completion_cache_path: Optional[Path] = None,
+    completion_cache_mode: Literal["read_through", "replay"] = "read_through",
 ):
+    """
+    completion_cache_path: Optional SQLite cache of the answer check (judge) completions. In "read_through" mode,
+        reruns only judge the answers that changed; in "replay" mode, all judgements are taken from the cache.
+        Judgements are keyed by the judge model's name, temperature, max_tokens and prompt.
+        The cache is imported from `src`, which then has to be on the PYTHONPATH.
+    """
+    completion_cache = None
+    if completion_cache_path:
+        from completion_cache import CompletionCache
+        completion_cache = CompletionCache(completion_cache_path, completion_cache_mode)
+
     async def main():
         data = load_benchmark_data(input_file)
 
         if document_database_grid:
             for document_database in document_database_grid:
                 rag.document_database = document_database
-                result = await run_document_benchmark(rag, data, repetitions, languages, rephrased_from_input, delay)
+                result = await run_document_benchmark(rag, data, repetitions, languages, rephrased_from_input, delay, completion_cache=completion_cache)
                 organized_output_file = process_config_and_create_folder(document_database.file / Path("multi_modal_config.json"), output_file, rephrased_from_input)
                 store_results(result, organized_output_file, rag.answer_generation_model)
                 time.sleep(delay)
         else:
-            result = await run_document_benchmark(rag, data, repetitions, languages, rephrased_from_input, output_filename=output_file.parent / "result_intermediate.json")
+            result = await run_document_benchmark(rag, data, repetitions, languages, rephrased_from_input, output_filename=output_file.parent / "result_intermediate.json", completion_cache=completion_cache)
             store_results(result, output_file, rag.answer_generation_model.name)
 
     asyncio.run(main())
+    if completion_cache is not None:
+        print(f"Completion cache: {completion_cache.summary()}")
+        completion_cache.close()
 
 
 if __name__ == "__main__":
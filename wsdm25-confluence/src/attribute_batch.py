@@ -0,0 +1,184 @@
+"""
+Computes attributions for many logged queries, e.g. for audits.
+
+Every line of the input JSONL holds one query:
+    {"id": "...", "question": "...", "answer": "...", "evidences": [{"id": ..., "title": ..., "url": ..., "content": ...}]}
+The `id` is optional (the line number is used instead) and so is the `answer` (it is generated then).
+
+The queries are attributed concurrently on one event loop and share one attributer: all LLM and embedding requests
+(including those for clustering the evidences) go through the same client, rate limiter and counterfactual cache.
+Every finished query is appended to the output JSONL right away, so an interrupted job continues with the remaining
+queries when it is started again. Failed queries are written to `<output>.errors.jsonl` and retried on the next run.
+
+Run from the `src` directory:
+    python attribute_batch.py --input_file queries.jsonl --output_file attributions.jsonl
+"""
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional, TextIO
+
+from attribution import Attribution
+from models.data import Document
+from openai import AsyncOpenAI
+from preprocessing.embedding import get_openai_api_key
+from utils import RateLimiter
+
+
+def load_queries(input_file: Path) -> List[Dict[str, Any]]:
+    queries = []
+    with input_file.open("r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file):
+            if line.strip():
+                query = json.loads(line)
+                query.setdefault("id", str(line_number))
+                queries.append(query)
+    return queries
+
+
+def load_completed_ids(output_file: Path) -> set:
+    if not output_file.exists():
+        return set()
+    completed_ids = set()
+    with output_file.open("r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                completed_ids.add(json.loads(line)["id"])
+            except json.JSONDecodeError:
+                continue  # A line that was cut off when the job was interrupted
+    return completed_ids
+
+
+async def attribute_query(
+    attributer: Attribution, query: Dict[str, Any], client: AsyncOpenAI, **attribution_kwargs
+) -> Dict[str, Any]:
+    evidences = [Document(**evidence) for evidence in query["evidences"]]
+    doc_probabilities, top_attribution, cluster_doc_mapping = await attributer.aget_attributions(
+        query["question"], evidences, history=[], answer=query.get("answer"), client=client, **attribution_kwargs
+    )
+    return {
+        "id": query["id"],
+        "question": query["question"],
+        "attribution": doc_probabilities,
+        "attributed_evidences": top_attribution.attributed_evidences,
+        "answer_counterfactual": top_attribution.answer_counterfactual,
+        "clusters": cluster_doc_mapping,
+    }
+
+
+class BatchProgress:
+    """ Progress and throughput of a batch; the requests per query are averaged over all attempted queries. """
+    def __init__(self, total: int, attributer: Attribution):
+        self.total = total
+        self.attributer = attributer
+        self.start = time.perf_counter()
+        self.attempted = 0  # Started, including failed and running queries, which also sent requests
+        self.done = 0
+        self.failed = 0
+
+    def report(self):
+        minutes = (time.perf_counter() - self.start) / 60
+        attempted = max(self.attempted, 1)
+        print(f"{self.done + self.failed}/{self.total} queries ({self.failed} failed, "
+              f"{self.attempted - self.done - self.failed} running) | {minutes:.1f} min | "
+              f"{self.done / minutes if minutes else 0.0:.1f} queries/min | "
+              f"{self.attributer.request_counts['llm_calls'] / attempted:.1f} LLM calls/query | "
+              f"{self.attributer.request_counts['embedding_requests'] / attempted:.1f} embedding requests/query")
+
+
+async def attribute_queries(
+    attributer: Attribution,
+    queries: List[Dict[str, Any]],
+    output: TextIO,
+    errors: TextIO,
+    workers: int,
+    report_seconds: float,
+    **attribution_kwargs,
+) -> BatchProgress:
+    """
+    Attributes at most `workers` queries concurrently. All of their requests are sent with one client, so they share
+    its connection pool. Progress is reported every `report_seconds`, starting right away.
+    """
+    progress = BatchProgress(len(queries), attributer)
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(client: AsyncOpenAI, query: Dict[str, Any]):
+        async with semaphore:
+            progress.attempted += 1
+            try:
+                result = await attribute_query(attributer, query, client, **attribution_kwargs)
+            except Exception as e:
+                progress.failed += 1
+                errors.write(json.dumps({"id": query["id"], "error": repr(e)}, ensure_ascii=False) + "\n")
+                errors.flush()
+                print(f"Attribution of query {query['id']} failed: {e}")
+            else:
+                progress.done += 1
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()  # Checkpoint: finished queries are skipped on the next run
+
+    async def report_periodically():
+        while True:
+            progress.report()
+            await asyncio.sleep(report_seconds)
+
+    async with AsyncOpenAI() as client:
+        reporter = asyncio.create_task(report_periodically())
+        try:
+            await asyncio.gather(*[run(client, query) for query in queries])
+        finally:
+            reporter.cancel()
+    progress.report()
+    return progress
+
+
+def main(
+    input_file: Path,
+    output_file: Path,
+    model_name: str = "gpt-4o-mini",
+    workers: int = 4,
+    max_concurrency: int = 8,
+    requests_per_minute: float = 500,
+    cache_path: Optional[Path] = Path("out/counterfactual_cache.db"),
+    strategy: Literal["exhaustive", "group_testing", "citations"] = "exhaustive",
+    report_seconds: float = 30.0,
+):
+    """
+    Parameters:
+        workers: The number of queries attributed concurrently.
+        max_concurrency: The maximum number of concurrent LLM calls per query.
+        requests_per_minute: The rate limit of all LLM and embedding requests together.
+        cache_path: The counterfactual cache shared by all queries (and runs); None disables it.
+        report_seconds: The interval in which progress and throughput are printed.
+    """
+    get_openai_api_key()
+
+    queries = load_queries(input_file)
+    completed_ids = load_completed_ids(output_file)
+    pending = [query for query in queries if query["id"] not in completed_ids]
+    print(f"{len(queries)} queries loaded, {len(queries) - len(pending)} already attributed, {len(pending)} pending.")
+
+    attributer = Attribution(
+        model_name,
+        max_concurrency=max_concurrency,
+        cache_path=cache_path,
+        rate_limiter=RateLimiter(requests_per_minute),
+    )
+
+    errors_file = output_file.with_suffix(".errors.jsonl")
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with output_file.open("a", encoding="utf-8") as output, errors_file.open("a", encoding="utf-8") as errors:
+        progress = asyncio.run(attribute_queries(
+            attributer, pending, output, errors, workers, report_seconds, strategy=strategy
+        ))
+
+    print(f"Attributions saved to: {output_file.resolve()}")
+    if progress.failed:
+        print(f"{progress.failed} queries failed, see {errors_file.resolve()}. Run the job again to retry them.")
+
+
+if __name__ == "__main__":
+    from jsonargparse import CLI
+
+    CLI(main, as_positional=False)
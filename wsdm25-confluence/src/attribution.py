@@ -1,13 +1,21 @@
-from copy import deepcopy
-from typing import List, Tuple, Union, Any, Dict
+import asyncio
+import re
+import threading
+import weakref
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple, Union, Any, Dict, Literal, Optional
 
 import numpy as np
 from jsonargparse import CLI
 from models.data import Document
-from preprocessing.embedding import embed_text
+from preprocessing.embedding import async_embed_texts, embed_texts
+from preprocessing.knn_graph import KnnGraph
 from pydantic import BaseModel
-from sklearn.cluster import DBSCAN
-from utils import chat_with_gpt
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessage
+from utils import async_chat_with_gpt, RateLimiter
+from counterfactual_cache import CounterfactualCache
 
 
 def masked_softmax(scores: list[float], temperature=0.1) -> np.ndarray:
@@ -64,6 +72,46 @@ def masked_softmax(scores: list[float], temperature=0.1) -> np.ndarray:
     return percentage_values
 
 
+citation_pattern = re.compile(r"\[([^\[\]]*Source[^\[\]]*)\]", re.IGNORECASE)
+word_pattern = re.compile(r"\w+")
+
+
+def parse_cited_sources(answer: str, num_evidences: int) -> List[int]:
+    """
+    Returns the (0-based) indices of the evidences cited in the answer as
+    [Source n], [Source 2, Source 5] or [Sources 2, 5]. The sources are
+    numbered by their position in the prompt, starting at 1.
+    """
+    cited = set()
+    for citation in citation_pattern.findall(answer):
+        for number in re.findall(r"\d+", citation):
+            if 1 <= int(number) <= num_evidences:
+                cited.add(int(number) - 1)
+    return sorted(cited)
+
+
+def lexical_overlap(answer: str, contents: List[str]) -> np.ndarray:
+    """
+    Computes the share of the answer's words (without citations) that occur
+    in each of the contents. Words are weighted by their inverse document
+    frequency among the contents, so that words occurring in all of them
+    (e.g. stop words) do not count.
+    """
+    answer_words = np.array(sorted(set(word_pattern.findall(citation_pattern.sub(" ", answer).lower()))))
+    if len(answer_words) == 0 or not contents:
+        return np.zeros(len(contents))
+
+    # Occurrence matrix: contents x answer words
+    occurrences = np.array([
+        np.isin(answer_words, word_pattern.findall(content.lower()))
+        for content in contents
+    ])
+    idf = np.log((len(contents) + 1) / (occurrences.sum(axis=0) + 1))
+    if idf.sum() == 0:
+        return np.zeros(len(contents))
+    return occurrences @ idf / idf.sum()
+
+
 class AttributionOutput(BaseModel):
     """
     Represents the output of an attribution calculation.
@@ -87,9 +135,49 @@ class AttributionOutput(BaseModel):
         return "\n".join(formatted)
 
 
+def threshold_graph_clusters(
+    similarities: np.ndarray, eps: float = 0.5, min_samples: int = 2
+) -> np.ndarray:
+    """
+    DBSCAN with cosine distance, computed from the pairwise cosine similarity
+    matrix of the passages: passages within `eps` of each other are
+    connected, passages with at least `min_samples` neighbours (including
+    themselves) are core points, and clusters are the connected components of
+    the core points plus their neighbours. Labels are assigned in the same
+    order as scikit-learn's DBSCAN, so the results match.
+
+    Returns:
+    --------
+    np.ndarray
+        Array of cluster labels for each passage, `-1` denotes an outlier.
+    """
+    neighbours = 1 - similarities <= eps
+    is_core = neighbours.sum(axis=1) >= min_samples
+
+    labels = np.full(len(similarities), -1)
+    label = 0
+    for idx in np.flatnonzero(is_core):
+        if labels[idx] != -1:
+            continue
+        labels[idx] = label
+        stack = [idx]
+        while stack:
+            # Only core points expand the cluster; their other neighbours join it as border points
+            neighbour_indices = np.flatnonzero(neighbours[stack.pop()] & (labels == -1))
+            labels[neighbour_indices] = label
+            stack.extend(neighbour_indices[is_core[neighbour_indices]])
+        label += 1
+    return labels
+
+
 class PassageCluster:
     """
     Clusters passages based on a chosen distance metric, defaulting to 'cosine'.
+    Cosine clustering runs on the similarity matrix in NumPy; other metrics
+    use scikit-learn's DBSCAN, which is only imported then.
+    If a `knn_graph` of the document collection is given, the similarities of
+    the passages are looked up in it, so they do not need to be computed.
+    Embedding requests wait for the optional `rate_limiter`.
 
     Methods:
     --------
@@ -97,18 +185,42 @@ class PassageCluster:
         Returns a list of cluster labels for each passage. Outliers are labeled '-1'.
     """
 
-    def __init__(self, metric: str = "cosine"):
+    def __init__(
+        self,
+        metric: str = "cosine",
+        knn_graph: Optional[KnnGraph] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
         self.metric = metric
+        self.knn_graph = knn_graph
+        self.rate_limiter = rate_limiter
+
+    def _get_embeddings(self, passages: List[Document]) -> List[np.ndarray]:
+        """
+        Returns the embedding of each passage. Passages retrieved from the
+        document database already carry their embedding; the remaining ones
+        are embedded with a single batched request.
+        """
+        embeddings = [passage.embedding for passage in passages]
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        if missing and self.rate_limiter:
+            self.rate_limiter.wait()
+        for idx, embedding in zip(
+            missing, embed_texts([passages[idx].content for idx in missing])
+        ):
+            embeddings[idx] = embedding
+        return embeddings
 
     def _get_feature_clusters(
-        self, passages: List[str], eps: float = 0.5, min_samples: int = 2
+        self, passages: List[Document], eps: float = 0.5, min_samples: int = 2,
+        embeddings: Optional[List[np.ndarray]] = None,
     ) -> np.ndarray:
         """
-        Embeds each passage and clusters the embeddings using DBSCAN.
+        Embeds each passage (if needed) and clusters the embeddings using DBSCAN.
 
         Parameters:
         -----------
-        passages : List[str]
+        passages : List[Document]
             The passages to cluster.
         eps : float
             The maximum distance between two samples for them to be considered
@@ -116,29 +228,45 @@ class PassageCluster:
         min_samples : int
             The number of samples in a neighborhood for a point to be considered
             a core point.
+        embeddings : Optional[List[np.ndarray]]
+            The embeddings of the passages, if they are already known.
 
         Returns:
         --------
         np.ndarray
             Array of cluster labels for each passage index.
         """
-        embeddings = [embed_text(passage) for passage in passages]
+        if self.metric == "cosine" and self.knn_graph is not None:
+            similarities = self.knn_graph.similarity_matrix(
+                [passage.id for passage in passages], min_similarity=1 - eps
+            )
+            if similarities is not None:
+                return threshold_graph_clusters(similarities, eps=eps, min_samples=min_samples)
+
+        if embeddings is None:
+            embeddings = self._get_embeddings(passages)
 
         embeddings = [embedding / np.linalg.norm(embedding) for embedding in embeddings]
         embeddings = np.array(embeddings)
+        if self.metric == "cosine":
+            return threshold_graph_clusters(embeddings @ embeddings.T, eps=eps, min_samples=min_samples)
+
+        from sklearn.cluster import DBSCAN
+
         clustering = DBSCAN(eps=eps, min_samples=min_samples, metric=self.metric)
         labels = clustering.fit_predict(embeddings)
         return labels
 
     def get_clusters(
-        self, passages: List[str], eps: float = 0.5, min_samples: int = 2
+        self, passages: List[Document], eps: float = 0.5, min_samples: int = 2,
+        embeddings: Optional[List[np.ndarray]] = None,
     ) -> List[int]:
         """
         Public method to handle clustering and catch any errors.
 
         Parameters:
         -----------
-        passages : List[str]
+        passages : List[Document]
             The passages to cluster.
         eps : float
             The maximum distance between two samples for them to be considered
@@ -146,6 +274,8 @@ class PassageCluster:
         min_samples : int
             The number of samples in a neighborhood for a point to be considered
             a core point.
+        embeddings : Optional[List[np.ndarray]]
+            The embeddings of the passages, if they are already known.
 
         Returns:
         --------
@@ -153,44 +283,226 @@ class PassageCluster:
             A list of cluster labels for each passage. `-1` denotes an outlier.
         """
         try:
-            return self._get_feature_clusters(passages, eps, min_samples).tolist()
+            return self._get_feature_clusters(passages, eps, min_samples, embeddings).tolist()
         except Exception as e:
             print(f"Error during clustering: \n {e}")
             return [-1 for _ in passages]
 
 
 class Attribution:
-    def __init__(self, model_name: str = "gpt-4o-mini"):
+    def __init__(
+        self,
+        model_name: str = "gpt-4o-mini",
+        max_concurrency: int = 8,
+        temperature: float = 0.7,
+        embedding_model: str = "text-embedding-3-small",
+        cache_path: Optional[Path] = None,
+        knn_graph: Optional[KnnGraph] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
         """
         Parameters:
         -----------
         model_name : str
             The model name or identifier for the GPT-like model.
+        max_concurrency : int
+            The maximum number of answers generated concurrently during attribution.
+        temperature : float
+            The sampling temperature for generating (counterfactual) answers.
+        embedding_model : str
+            The model used to embed answers for comparing them.
+        cache_path : Optional[Path]
+            If set, generated answers and their embeddings are cached in this
+            SQLite database and reused across questions and runs.
+        knn_graph : Optional[KnnGraph]
+            The kNN graph of the document collection (see `prepare`), used to
+            look up the similarities of evidences for clustering.
+        rate_limiter : Optional[RateLimiter]
+            If set, every LLM and embedding request waits for it. Share one
+            limiter to attribute several questions concurrently, e.g. on a
+            thread pool (see `attribute_batch.py`).
         """
-        self.passage_cluster = PassageCluster()
+        self.passage_cluster = PassageCluster(knn_graph=knn_graph, rate_limiter=rate_limiter)
         self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.temperature = temperature
+        self.embedding_model = embedding_model
+        self.cache = CounterfactualCache(cache_path) if cache_path else None
+        self.rate_limiter = rate_limiter
+
+        # Number of LLM and embedding requests sent, across all attributions
+        self.request_counts = Counter()
+        self._request_counts_lock = threading.Lock()
+
+        # One client per event loop, whose connections are reused by all requests on it; `get_attributions` runs on
+        # an event loop of the attributer (started on first use), so that all its calls share one client
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
 
-    def _evaluate_answer_pair(self, answer: str, counterfactual_answer: str) -> float:
+    def async_client(self) -> AsyncOpenAI:
+        """
+        Returns the client of the running event loop, which is created on first use and shared by all requests
+        of the attributer on that loop (and by `rag.arag`). It is closed by `close` or `aclose`.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = AsyncOpenAI()
+        return client
+
+    def _run(self, coroutine):
+        """ Runs the coroutine on the event loop of the attributer and waits for its result. """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="attribution", daemon=True)
+                self._loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def aclose(self):
+        """ Closes the client of the running event loop. """
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def close(self):
+        """ Closes the client and stops the event loop used by `get_attributions`. """
+        with self._loop_lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = self._loop_thread = None
+
+    def _count_requests(self, name: str, count: int = 1):
+        with self._request_counts_lock:
+            self.request_counts[name] += count
+
+    async def _generate_answers(
+        self,
+        question: str,
+        evidences: List[Document],
+        masks: List[List[bool]],
+        client: Optional[AsyncOpenAI] = None,
+    ) -> List[ChatCompletionMessage]:
+        """
+        Generates one answer per mask concurrently, with at most
+        `max_concurrency` requests in flight. Evidences whose mask entry is
+        True are left out of the prompt. The answers are returned in the
+        order of the masks. Cached answers are not generated again.
+        The requests are sent with `client` if given, otherwise with the
+        shared client of the running event loop (see `async_client`).
+        """
+        answers: List[Optional[ChatCompletionMessage]] = [None] * len(masks)
+        if self.cache:
+            keys = [
+                CounterfactualCache.answer_key(self.model_name, self.temperature, question, evidences, mask)
+                for mask in masks
+            ]
+            for idx, cached_answer in enumerate(self.cache.get_answers(keys)):
+                if cached_answer is not None:
+                    answers[idx] = ChatCompletionMessage(role="assistant", content=cached_answer)
+
+        missing = [idx for idx, answer in enumerate(answers) if answer is None]
+        if not missing:
+            return answers
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def generate(client: AsyncOpenAI, mask: List[bool]) -> ChatCompletionMessage:
+            async with semaphore:
+                if self.rate_limiter:
+                    await self.rate_limiter.async_wait()
+                return await async_chat_with_gpt(
+                    question, evidences, model=self.model_name, client=client,
+                    mask=mask, temperature=self.temperature,
+                )
+
+        client = client or self.async_client()
+        generated = await asyncio.gather(*[generate(client, masks[idx]) for idx in missing])
+        self._count_requests("llm_calls", len(missing))
+
+        for idx, answer in zip(missing, generated):
+            answers[idx] = answer
+        if self.cache:
+            self.cache.add_answers([keys[idx] for idx in missing], [answer.content for answer in generated])
+        return answers
+
+    async def _request_embeddings(
+        self, texts: List[str], client: Optional[AsyncOpenAI] = None
+    ) -> List[np.ndarray]:
+        if self.rate_limiter:
+            await self.rate_limiter.async_wait()
+        self._count_requests("embedding_requests")
+        return await async_embed_texts(texts, model=self.embedding_model, client=client or self.async_client())
+
+    async def _embed_evidences(
+        self, evidences: List[Document], client: Optional[AsyncOpenAI] = None
+    ) -> List[np.ndarray]:
+        """
+        Returns the embedding of each evidence. Evidences retrieved from the
+        document database already carry their embedding; the remaining ones
+        are embedded with a single request.
+        """
+        embeddings = [evidence.embedding for evidence in evidences]
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_embeddings = await self._request_embeddings([evidences[idx].content for idx in missing], client)
+            for idx, embedding in zip(missing, missing_embeddings):
+                embeddings[idx] = embedding
+        return embeddings
+
+    async def _embed_answers(
+        self, answers: List[str], client: Optional[AsyncOpenAI] = None
+    ) -> List[np.ndarray]:
+        """
+        Embeds the answers with a single request; cached embeddings are reused.
+        """
+        if not self.cache:
+            return await self._request_embeddings(answers, client)
+
+        embeddings = self.cache.get_embeddings(self.embedding_model, answers)
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            missing_answers = [answers[idx] for idx in missing]
+            missing_embeddings = await self._request_embeddings(missing_answers, client)
+            self.cache.add_embeddings(self.embedding_model, missing_answers, missing_embeddings)
+            for idx, embedding in zip(missing, missing_embeddings):
+                embeddings[idx] = embedding
+        return embeddings
+
+    async def _evaluate_answers(
+        self,
+        answer: str,
+        counterfactual_answers: List[str],
+        client: Optional[AsyncOpenAI] = None,
+    ) -> np.ndarray:
         """
         Evaluates the difference/similarity between the original answer and
-        a counterfactual answer by computing embeddings and measuring
-        1 - (dot_product).
+        each counterfactual answer by computing embeddings and measuring
+        1 - (dot_product). All answers are embedded with a single request
+        (unless cached).
 
         Parameters:
         -----------
         answer : str
             The original answer text.
-        counterfactual_answer : str
-            The answer text generated without certain evidences.
+        counterfactual_answers : List[str]
+            The answer texts generated without certain evidences.
 
         Returns:
         --------
-        float
-            A scalar similarity/dissimilarity measure. Larger means more
-            dissimilar in this example.
+        np.ndarray
+            One similarity/dissimilarity measure per counterfactual answer.
+            Larger means more dissimilar in this example.
         """
-        embedding_answer = embed_text(answer)
-        embedding_counterfactual = embed_text(counterfactual_answer)
+        embeddings = await self._embed_answers([answer] + counterfactual_answers, client)
+        embedding_answer = embeddings[0]
+        embedding_counterfactuals = np.array(embeddings[1:])
 
         # Normalize the embeddings to unit length
         # original work at https://arxiv.org/pdf/2412.10571
@@ -198,11 +510,284 @@ class Attribution:
         # (https://huggingface.co/jinaai/jina-embeddings-v3)
         # but here we use OpenAI functions for simplicity
         embedding_answer = embedding_answer / np.linalg.norm(embedding_answer)
-        embedding_counterfactual = embedding_counterfactual / np.linalg.norm(
-            embedding_counterfactual
+        embedding_counterfactuals = embedding_counterfactuals / np.linalg.norm(
+            embedding_counterfactuals, axis=1, keepdims=True
+        )
+
+        return 1 - embedding_counterfactuals @ embedding_answer
+
+    async def _exhaustive_attributions(
+        self,
+        question: str,
+        evidences: List[Document],
+        answer: Union[str, None],
+        cluster_indices_per_cluster: List[List[int]],
+        client: Optional[AsyncOpenAI] = None,
+    ) -> Tuple[np.ndarray, List[AttributionOutput]]:
+        """
+        Leave-one-cluster-out: generates one counterfactual answer per cluster.
+
+        Returns:
+        --------
+        Tuple[np.ndarray, List[AttributionOutput]]
+            The dissimilarity to the baseline answer and the counterfactual
+            per cluster.
+        """
+        # Mask the evidences of each cluster; the prompt builder blanks out
+        # the content of masked evidences, so no documents are copied
+        counterfactual_masks = [
+            self._get_mask(cluster_indices, len(evidences))
+            for cluster_indices in cluster_indices_per_cluster
+        ]
+
+        # Generate the full answer (with all evidences), unless it is known,
+        # together with the counterfactual answers per cluster
+        no_mask = [False] * len(evidences)
+        masks = counterfactual_masks if answer else [no_mask] + counterfactual_masks
+        completions = await self._generate_answers(question, evidences, masks, client)
+        baseline_answer = answer if answer else completions.pop(0).content
+
+        cf_results: List[AttributionOutput] = [
+            AttributionOutput(
+                attributed_evidences=cluster_indices,
+                answer_counterfactual=completion.content,
+            )
+            for cluster_indices, completion in zip(cluster_indices_per_cluster, completions)
+        ]
+
+        # Compute which cluster leads to the largest difference from the baseline
+        dissimilarities = await self._evaluate_answers(
+            baseline_answer, [cf.answer_counterfactual for cf in cf_results], client
         )
+        return dissimilarities, cf_results
+
+    async def _group_testing_attributions(
+        self,
+        question: str,
+        evidences: List[Document],
+        answer: Union[str, None],
+        cluster_indices_per_cluster: List[List[int]],
+        call_budget: Optional[int] = None,
+        concentration: float = 0.9,
+        change_threshold: float = 0.05,
+        client: Optional[AsyncOpenAI] = None,
+    ) -> Tuple[np.ndarray, List[AttributionOutput]]:
+        """
+        Adaptive group testing (binary splitting): first, all clusters are
+        removed at once. Each group whose removal changes the answer by at
+        least `change_threshold` is split in two halves, and only the first
+        half is tested: if its removal does not change the answer, the change
+        of the group is due to the second half, which is not tested but
+        inferred (it gets the dissimilarity and counterfactual of the group).
+        Otherwise, the second half is tested as well. Changing halves are
+        split again, until single clusters remain. The first halves of a
+        round are generated concurrently, then the second halves that need a
+        test.
+
+        Each cluster is scored with the dissimilarity of the smallest tested
+        (or inferred) group containing it. The search stops when no group is
+        left to split, when `call_budget` counterfactual answers have been
+        generated, or when a single cluster holds `concentration` of the
+        softmax mass. If only a few clusters matter, this needs O(log n)
+        instead of n calls. With few clusters or a larger share of clusters
+        that matter, it needs more calls than the exhaustive strategy, e.g.
+        for 10 evidences of which 2 or 3 matter (see `benchmarks.attribution`).
+        The inference assumes that the evidences of the
+        two halves do not stand in for each other; clusters of near-duplicates
+        are removed together for this reason.
+
+        Returns:
+        --------
+        Tuple[np.ndarray, List[AttributionOutput]]
+            The dissimilarity to the baseline answer and the counterfactual
+            (of the smallest tested group) per cluster.
+        """
+        if call_budget is not None and call_budget < 2:
+            raise ValueError("Group testing needs a call budget of at least 2.")
+
+        num_clusters = len(cluster_indices_per_cluster)
+        dissimilarities = np.zeros(num_clusters)
+        cf_results: List[Optional[AttributionOutput]] = [None] * num_clusters
+        baseline_answer = answer
+        num_calls = 0
+
+        def assign(group: List[int], dissimilarity: float, cf_output: AttributionOutput):
+            for cluster in group:
+                dissimilarities[cluster] = dissimilarity
+                cf_results[cluster] = cf_output
+
+        async def test(groups: List[List[int]]) -> List[Tuple[float, AttributionOutput]]:
+            """ Generates the counterfactual answers without each group, within the call budget. """
+            nonlocal baseline_answer, num_calls
+            if call_budget is not None:
+                groups = groups[: call_budget - num_calls]
+            if not groups:
+                return []
 
-        return 1 - float(np.dot(embedding_answer, embedding_counterfactual))
+            group_indices = [
+                sorted(idx for cluster in group for idx in cluster_indices_per_cluster[cluster])
+                for group in groups
+            ]
+            masks = [self._get_mask(indices, len(evidences)) for indices in group_indices]
+            if baseline_answer is None:
+                masks = [[False] * len(evidences)] + masks
+            completions = await self._generate_answers(question, evidences, masks, client)
+            if baseline_answer is None:
+                baseline_answer = completions.pop(0).content
+            num_calls += len(groups)
+
+            group_dissimilarities = await self._evaluate_answers(
+                baseline_answer, [completion.content for completion in completions], client
+            )
+            results = []
+            for group, indices, completion, dissimilarity in zip(groups, group_indices, completions, group_dissimilarities):
+                cf_output = AttributionOutput(attributed_evidences=indices, answer_counterfactual=completion.content)
+                assign(group, dissimilarity, cf_output)
+                results.append((dissimilarity, cf_output))
+            return results
+
+        # Groups of several clusters whose removal changes the answer, with their dissimilarity and counterfactual
+        all_clusters = list(range(num_clusters))
+        changing = [
+            (all_clusters, dissimilarity, cf_output)
+            for dissimilarity, cf_output in await test([all_clusters])
+            if dissimilarity >= change_threshold and num_clusters > 1
+        ]
+        while changing:
+            next_changing = []
+            halves = [self._split_group(group) for group, _, _ in changing]
+            first_results = await test([parts[0] for parts in halves])
+
+            tested_second_halves = []
+            for (group, dissimilarity, cf_output), parts, (first_dissimilarity, first_cf_output) in zip(
+                changing, halves, first_results
+            ):
+                first, second = parts
+                if first_dissimilarity >= change_threshold:
+                    next_changing.append((first, first_dissimilarity, first_cf_output))
+                    tested_second_halves.append(second)
+                else:
+                    # The first half does not matter, so the change is due to the second half
+                    inferred = AttributionOutput(
+                        attributed_evidences=sorted(
+                            idx for cluster in second for idx in cluster_indices_per_cluster[cluster]
+                        ),
+                        answer_counterfactual=cf_output.answer_counterfactual,
+                    )
+                    assign(second, dissimilarity, inferred)
+                    next_changing.append((second, dissimilarity, inferred))
+
+            second_results = await test(tested_second_halves)
+            for second, (second_dissimilarity, second_cf_output) in zip(tested_second_halves, second_results):
+                if second_dissimilarity >= change_threshold:
+                    next_changing.append((second, second_dissimilarity, second_cf_output))
+
+            if call_budget is not None and num_calls >= call_budget:
+                break
+            if masked_softmax(dissimilarities).max() >= concentration * 100:
+                break
+            changing = [(group, dissimilarity, cf_output) for group, dissimilarity, cf_output in next_changing
+                        if len(group) > 1]
+
+        return dissimilarities, cf_results
+
+    async def _citation_attributions(
+        self,
+        question: str,
+        evidences: List[Document],
+        answer: Union[str, None],
+        cluster_indices_per_cluster: List[List[int]],
+        citation_overlap: float = 0.5,
+        citation_similarity: float = 0.8,
+        citation_dissimilarity: float = 0.3,
+        client: Optional[AsyncOpenAI] = None,
+    ) -> Tuple[np.ndarray, List[AttributionOutput]]:
+        """
+        Attributes the answer by its [Source n] citations, and only generates
+        counterfactual answers for the clusters where the citations are not
+        backed up by the content.
+
+        An evidence supports the answer if at least `citation_overlap` of the
+        (idf-weighted) answer's words occur in it, or if the cosine similarity of their
+        embeddings is at least `citation_similarity`. Clusters that are cited
+        and support the answer are attributed without a counterfactual (their
+        counterfactual answer is empty), clusters that are neither cited nor
+        support the answer are not attributed. All other clusters are ambiguous
+        and scored with the exhaustive strategy. Answers without citations are
+        attributed exhaustively.
+
+        All scores are dissimilarities, so that they can be compared in one
+        softmax: cited and supported clusters are scored as if removing them
+        changed the answer by `citation_dissimilarity` (about the largest
+        dissimilarity of a counterfactual answer), or by the largest
+        dissimilarity of an ambiguous cluster if that is larger.
+
+        Returns:
+        --------
+        Tuple[np.ndarray, List[AttributionOutput]]
+            The score and the counterfactual per cluster.
+        """
+        if answer is None:
+            no_mask = [False] * len(evidences)
+            answer = (await self._generate_answers(question, evidences, [no_mask], client))[0].content
+
+        cited = set(parse_cited_sources(answer, len(evidences)))
+        if not cited:
+            return await self._exhaustive_attributions(
+                question, evidences, answer, cluster_indices_per_cluster, client
+            )
+
+        # Vectorized overlap of the answer with all evidences
+        overlap = lexical_overlap(answer, [doc.content for doc in evidences])
+        answer_embeddings, evidence_embeddings = await asyncio.gather(
+            self._embed_answers([answer], client),
+            self._embed_evidences(evidences, client),
+        )
+        embedding_answer = answer_embeddings[0]
+        embeddings = np.array(evidence_embeddings)
+        similarity = embeddings @ embedding_answer / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(embedding_answer)
+        )
+        support = (overlap >= citation_overlap) | (similarity >= citation_similarity)
+
+        scores = np.zeros(len(cluster_indices_per_cluster))
+        cf_results: List[Optional[AttributionOutput]] = [None] * len(cluster_indices_per_cluster)
+        attributed, ambiguous = [], []
+        for cluster, cluster_indices in enumerate(cluster_indices_per_cluster):
+            is_cited = any(idx in cited for idx in cluster_indices)
+            is_supported = bool(support[cluster_indices].any())
+            if is_cited and is_supported:
+                attributed.append(cluster)
+                cf_results[cluster] = AttributionOutput(
+                    attributed_evidences=cluster_indices, answer_counterfactual=""
+                )
+            elif is_cited or is_supported:
+                ambiguous.append(cluster)
+            else:
+                cf_results[cluster] = AttributionOutput(
+                    attributed_evidences=cluster_indices, answer_counterfactual=answer
+                )
+
+        if ambiguous:
+            ambiguous_scores, ambiguous_results = await self._exhaustive_attributions(
+                question, evidences, answer, [cluster_indices_per_cluster[cluster] for cluster in ambiguous], client
+            )
+            for cluster, score, cf_output in zip(ambiguous, ambiguous_scores, ambiguous_results):
+                scores[cluster] = score
+                cf_results[cluster] = cf_output
+
+        scores[attributed] = max(citation_dissimilarity, scores.max())
+        return scores, cf_results
+
+    @staticmethod
+    def _split_group(group: List[int]) -> List[List[int]]:
+        half = (len(group) + 1) // 2
+        return [part for part in (group[:half], group[half:]) if part]
+
+    @staticmethod
+    def _get_mask(indices: List[int], num_evidences: int) -> List[bool]:
+        masked = set(indices)
+        return [idx in masked for idx in range(num_evidences)]
 
     def _distribute_cluster_probabilities(
         self, cluster_probs: np.ndarray, clusters: List[int]
@@ -241,13 +826,25 @@ class Attribution:
         answer: Union[str, None] = None,
         eps: float = 0.005,
         min_samples: int = 2,
+        strategy: Literal["exhaustive", "group_testing", "citations"] = "exhaustive",
+        call_budget: Optional[int] = None,
+        concentration: float = 0.9,
+        change_threshold: float = 0.05,
+        citation_overlap: float = 0.5,
+        citation_similarity: float = 0.8,
+        citation_dissimilarity: float = 0.3,
     ) -> Tuple[List[str], AttributionOutput, Dict[str, List[int]]]:
         """
         Given a question and a set of evidence passages, this method:
         1. Clusters the passages using PassageCluster.
         2. Generates a 'baseline' answer with all evidences.
         3. For each cluster, removes it from the set of evidences and generates
-           a counterfactual answer.
+           a counterfactual answer. The baseline and counterfactual answers are
+           generated concurrently. With the "group_testing" strategy, groups
+           of clusters are removed instead, see `_group_testing_attributions`.
+           With the "citations" strategy, only clusters whose attribution is
+           not clear from the cited sources are removed, see
+           `_citation_attributions`.
         4. Computes which cluster removal leads to the greatest difference
            from the baseline answer (i.e., which cluster is most "attributive").
 
@@ -263,19 +860,105 @@ class Attribution:
         history : List[str]
             A list of previous user queries or dialogue context (currently unused
             in the logic but provided for future expansions).
+        strategy : str
+            "exhaustive" removes each cluster once, "group_testing" splits
+            groups of clusters adaptively and needs fewer LLM calls when only
+            a few of many evidences matter (but more than "exhaustive" if
+            there are only a few clusters), "citations" trusts the [Source n]
+            citations of the answer where the evidence content backs them up.
+        call_budget : Optional[int]
+            The maximum number of counterfactual answers for "group_testing".
+        concentration : float
+            "group_testing" stops early once a single cluster holds this share
+            of the softmax mass.
+        change_threshold : float
+            The dissimilarity from which "group_testing" considers the answer
+            changed, i.e. below which a group is not split any further.
+        citation_overlap : float
+            The (idf-weighted) share of answer words an evidence has to contain
+            to support the answer for "citations".
+        citation_similarity : float
+            The embedding similarity from which an evidence supports the answer
+            for "citations".
+        citation_dissimilarity : float
+            The minimum score of cited clusters that support the answer for
+            "citations", on the scale of the counterfactual dissimilarities.
 
         Returns:
         --------
         AttributionOutput
             The cluster that contributed the most to the final answer
             and the counterfactual answer without that cluster.
+
+        Raises:
+        -------
+        RuntimeError
+            If called from a running event loop (e.g. in async code or a
+            notebook), which it would block until the attribution, running
+            on the event loop of the attributer, has finished. Await
+            `aget_attributions` there instead.
         """
-        # Cluster the evidences
-        evidence_contents = [doc.content for doc in evidences]
-        clusters = self.passage_cluster.get_clusters(
-            evidence_contents, eps=eps, min_samples=min_samples
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("get_attributions cannot be called from a running event loop, "
+                               "await aget_attributions instead.")
+        return self._run(self.aget_attributions(
+            question, evidences, history, answer, eps, min_samples, strategy, call_budget,
+            concentration, change_threshold, citation_overlap, citation_similarity, citation_dissimilarity,
+        ))
+
+    async def cluster_evidences(
+        self, evidences: List[Document], eps: float = 0.005, min_samples: int = 2,
+        client: Optional[AsyncOpenAI] = None,
+    ) -> List[int]:
+        """
+        Clusters the evidences on a worker thread, so that it can run while
+        the answer is generated (see `rag.arag`). Evidences without an
+        embedding are embedded beforehand, with the same client as the other
+        requests.
+        """
+        embeddings = await self._embed_evidences(evidences, client)
+        return await asyncio.to_thread(
+            self.passage_cluster.get_clusters, evidences, eps, min_samples, embeddings
         )
 
+    async def aget_attributions(
+        self,
+        question: str,
+        evidences: List[Document],
+        history: List[str],
+        answer: Union[str, None] = None,
+        eps: float = 0.005,
+        min_samples: int = 2,
+        strategy: Literal["exhaustive", "group_testing", "citations"] = "exhaustive",
+        call_budget: Optional[int] = None,
+        concentration: float = 0.9,
+        change_threshold: float = 0.05,
+        citation_overlap: float = 0.5,
+        citation_similarity: float = 0.8,
+        citation_dissimilarity: float = 0.3,
+        clusters: Optional[List[int]] = None,
+        client: Optional[AsyncOpenAI] = None,
+    ) -> Tuple[List[str], AttributionOutput, Dict[str, List[int]]]:
+        """
+        Same as `get_attributions`, but awaitable.
+
+        Parameters:
+        -----------
+        clusters : Optional[List[int]]
+            The cluster labels of the evidences if they are already known,
+            see `cluster_evidences`.
+        client : Optional[AsyncOpenAI]
+            A client shared with other requests, so that its connections are
+            reused. Otherwise, the client of the attributer for the running
+            event loop is used (see `async_client`).
+        """
+        if clusters is None:
+            clusters = await self.cluster_evidences(evidences, eps=eps, min_samples=min_samples, client=client)
+
         # Convert outliers (-1) to unique new cluster IDs
         unique_cluster_id = max(clusters) + 1 if clusters else 0
         adjusted_clusters = []
@@ -286,45 +969,25 @@ class Attribution:
             else:
                 adjusted_clusters.append(label)
 
-        # Generate the full answer (with all evidences)
-        if answer:
-            baseline_answer = answer
-        else:
-            baseline_completion = chat_with_gpt(
-                question, evidences, model=self.model_name
+        cluster_indices_per_cluster = [
+            [idx for idx, label in enumerate(adjusted_clusters) if label == cluster_id]
+            for cluster_id in set(adjusted_clusters)
+        ]
+
+        if strategy == "group_testing":
+            dissimilarities, cf_results = await self._group_testing_attributions(
+                question, evidences, answer, cluster_indices_per_cluster,
+                call_budget, concentration, change_threshold, client,
             )
-            baseline_answer = baseline_completion.content
-
-        # Generate counterfactual answers per cluster
-        cf_results: List[AttributionOutput] = []
-        cluster_set = set(adjusted_clusters)
-        for cluster_id in cluster_set:
-            # Deepcopy the documents to remove the relevant cluster's content
-            modified_docs = deepcopy(evidences)
-            cluster_indices: List[int] = []
-
-            for idx, label in enumerate(adjusted_clusters):
-                if label == cluster_id:
-                    # Mark this doc as belonging to the cluster being zeroed
-                    cluster_indices.append(idx)
-                    modified_docs[idx].content = ""  # Remove/blank out content
-
-            cf_completion = chat_with_gpt(
-                question, modified_docs, model=self.model_name
+        elif strategy == "citations":
+            dissimilarities, cf_results = await self._citation_attributions(
+                question, evidences, answer, cluster_indices_per_cluster,
+                citation_overlap, citation_similarity, citation_dissimilarity, client,
             )
-            counterfactual_answer = cf_completion.content
-
-            cf_output = AttributionOutput(
-                attributed_evidences=cluster_indices,
-                answer_counterfactual=counterfactual_answer,
+        else:
+            dissimilarities, cf_results = await self._exhaustive_attributions(
+                question, evidences, answer, cluster_indices_per_cluster, client
             )
-            cf_results.append(cf_output)
-
-        # Compute which cluster leads to the largest difference from the baseline
-        dissimilarities = [
-            self._evaluate_answer_pair(baseline_answer, cf.answer_counterfactual)
-            for cf in cf_results
-        ]
 
         softmax_output = masked_softmax(dissimilarities)
         max_idx = int(np.argmax(dissimilarities))
@@ -368,6 +1031,7 @@ def main(model_name: str = "gpt-4o"):
     softmax_output, attribution_result, cluster_doc_mapping = (
         attributer.get_attributions(question, doc_objects, history)
     )
+    attributer.close()
     print("Evidence Probability:", softmax_output)
     print("Most important evidence:", attribution_result)
     print("Cluster Document Mapping:", cluster_doc_mapping)
@@ -0,0 +1,126 @@
+"""
+Compares the number of counterfactual LLM calls of the exhaustive (leave-one-cluster-out) attribution
+with the group testing strategy, and how well the two agree.
+
+The LLM and the answer embeddings are simulated, so no API calls are made: a few evidences per question are relevant,
+each with a random weight, the answer is the set of relevant evidences left in the prompt, and the dissimilarity
+to the baseline answer is the weight of the relevant evidences that were removed.
+The evidences are clustered as usual; some of them are near-duplicates of others.
+
+Group testing only needs fewer calls than the exhaustive strategy when few of many evidences are relevant. For only a
+few clusters with several relevant ones (e.g. 10 evidences with 2 or 3 relevant ones), it needs more calls, since it
+also removes all clusters at once and tests both halves of a group whenever its first half matters; these rows are
+marked in the output.
+
+Run from the `src` directory:
+    python -m benchmarks.attribution --num_evidences "[10, 20, 50]" --num_relevant "[1, 2, 3]"
+"""
+import random
+from typing import List, Dict, Optional
+
+import numpy as np
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessage
+
+from attribution import Attribution
+from models.data import Document
+
+
+class SimulatedAttribution(Attribution):
+    def __init__(self, weights: Dict[int, float]):
+        super().__init__(model_name="simulated")
+        self.weights = weights
+        self.num_calls = 0
+
+    async def _generate_answers(self, question: str, evidences: List[Document], masks: List[List[bool]],
+                                client: Optional[AsyncOpenAI] = None) -> List[ChatCompletionMessage]:
+        self.num_calls += len(masks)
+        return [
+            ChatCompletionMessage(role="assistant", content=",".join(str(idx) for idx in sorted(self.weights) if not mask[idx]))
+            for mask in masks
+        ]
+
+    async def _evaluate_answers(self, answer: str, counterfactual_answers: List[str],
+                                client: Optional[AsyncOpenAI] = None) -> np.ndarray:
+        baseline = set(answer.split(",")) - {""}
+        total = sum(self.weights[int(idx)] for idx in baseline) or 1.0
+        return np.array([
+            sum(self.weights[int(idx)] for idx in baseline - set(counterfactual.split(","))) / total
+            for counterfactual in counterfactual_answers
+        ])
+
+
+def _synthetic_evidences(rng: random.Random, num_evidences: int, duplicate_ratio: float = 0.2) -> List[Document]:
+    np_rng = np.random.default_rng(rng.randrange(2 ** 32))
+    embeddings = []
+    for _ in range(num_evidences):
+        if embeddings and rng.random() < duplicate_ratio:
+            embeddings.append(rng.choice(embeddings) + np_rng.normal(scale=1e-4, size=64))
+        else:
+            embeddings.append(np_rng.normal(size=64))
+    return [Document(id=str(idx), title="", url="", content=f"Evidence {idx}", embedding=embedding)
+            for idx, embedding in enumerate(embeddings)]
+
+
+def _probabilities(formatted: List[str]) -> np.ndarray:
+    return np.array([float(doc.split(": ")[1]) for doc in formatted])
+
+
+def run_trial(rng: random.Random, num_evidences: int, num_relevant: int, call_budget: Optional[int], concentration: float):
+    evidences = _synthetic_evidences(rng, num_evidences)
+    weights = {idx: rng.uniform(0.2, 1.0) for idx in rng.sample(range(num_evidences), num_relevant)}
+    answer = ",".join(str(idx) for idx in sorted(weights))
+
+    results = {}
+    for strategy in ["exhaustive", "group_testing"]:
+        attributer = SimulatedAttribution(weights)
+        probabilities, top, _ = attributer.get_attributions(
+            "question", evidences, history=[], answer=answer,
+            strategy=strategy, call_budget=call_budget, concentration=concentration,
+        )
+        attributer.close()
+        results[strategy] = (attributer.num_calls, _probabilities(probabilities), set(top.attributed_evidences))
+
+    exhaustive_calls, exhaustive_probabilities, exhaustive_top = results["exhaustive"]
+    group_calls, group_probabilities, group_top = results["group_testing"]
+    return {
+        "exhaustive_calls": exhaustive_calls,
+        "group_testing_calls": group_calls,
+        "top_agreement": float(exhaustive_top <= group_top and len(group_top) == len(exhaustive_top)),
+        "top_document_agreement": float(np.argmax(exhaustive_probabilities) == np.argmax(group_probabilities)),
+        # Total variation distance between the document probabilities (in percent)
+        "probability_distance": float(np.abs(exhaustive_probabilities - group_probabilities).sum() / 2),
+    }
+
+
+def main(
+    num_evidences: Optional[List[int]] = None,
+    num_relevant: Optional[List[int]] = None,
+    trials: int = 50,
+    call_budget: Optional[int] = None,
+    concentration: float = 0.9,
+    seed: int = 0,
+):
+    num_evidences = num_evidences or [10, 20, 50]
+    num_relevant = num_relevant or [1, 2, 3]
+    rng = random.Random(seed)
+
+    print(10 * "=" + " ATTRIBUTION BENCHMARK " + 10 * "=")
+    print("evidences | relevant | exhaustive calls | group testing calls | top cluster agreement | top doc agreement | TV distance")
+    more_calls = False
+    for evidences in num_evidences:
+        for relevant in num_relevant:
+            trial_results = [run_trial(rng, evidences, relevant, call_budget, concentration) for _ in range(trials)]
+            mean = {key: np.mean([result[key] for result in trial_results]) for key in trial_results[0]}
+            print(f"{evidences:>9} | {relevant:>8} | {mean['exhaustive_calls']:>16.1f} | {mean['group_testing_calls']:>19.1f} | "
+                  f"{mean['top_agreement']:>21.2f} | {mean['top_document_agreement']:>17.2f} | {mean['probability_distance']:>10.1f}%"
+                  + (" *" if mean['group_testing_calls'] > mean['exhaustive_calls'] else ""))
+            more_calls |= mean['group_testing_calls'] > mean['exhaustive_calls']
+    if more_calls:
+        print("* Group testing needs more calls than the exhaustive strategy")
+
+
+if __name__ == "__main__":
+    from jsonargparse import CLI
+
+    CLI(main, as_positional=False)
@@ -0,0 +1,189 @@
+"""
+Benchmarks the Confluence preprocessing path on synthetic corpora derived from the ConfQuestions pages.
+
+Every page of the source corpus is kept as is (scale 1). For larger scales, each page is copied `scale - 1` times,
+and every copy gets additional synthetic sections: headings of random depth, paragraphs, nested lists and tables of
+varying size with multi-level (colspan) headers and rowspan cells. The text is sampled from the source corpus.
+
+Each scale runs `run_pipeline` in a separate process, so that the peak RSS is measured per scale.
+The results are printed, and also saved as JSON if an `output_file` is given.
+
+Run from the `src` directory:
+    python -m benchmarks.preprocessing --scales "[1, 10, 100]"
+"""
+import json
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+from bs4 import BeautifulSoup
+
+from prepare import WebDocument, fetch_documents_from_folder
+from preprocessing.heterogenous_data.entrypoint import run_pipeline
+from preprocessing.model import VerbalizerConfig
+
+
+def _sentence(rng: random.Random, words: List[str], min_words: int = 3, max_words: int = 20) -> str:
+    return " ".join(rng.choices(words, k=rng.randint(min_words, max_words)))
+
+
+def _heading(rng: random.Random, words: List[str]) -> str:
+    level = rng.randint(1, 6)
+    return f"<h{level}>{_sentence(rng, words, 1, 6)}</h{level}>"
+
+
+def _paragraph(rng: random.Random, words: List[str]) -> str:
+    return "<p>" + ". ".join(_sentence(rng, words) for _ in range(rng.randint(1, 6))) + ".</p>"
+
+
+def _nested_list(rng: random.Random, words: List[str], depth: int = 0) -> str:
+    tag = rng.choice(["ul", "ol"])
+    items = []
+    for _ in range(rng.randint(2, 8)):
+        item = _sentence(rng, words, 1, 10)
+        if depth < 3 and rng.random() < 0.2:
+            item += _nested_list(rng, words, depth + 1)
+        items.append(f"<li>{item}</li>")
+    return f"<{tag}>{''.join(items)}</{tag}>"
+
+
+def _table(rng: random.Random, words: List[str], max_rows: int) -> str:
+    num_columns = rng.randint(2, 8)
+    header_rows = []
+
+    if rng.random() < 0.4:
+        # Two-level header: grouped columns on top, single columns below
+        top_cells, covered = [], 0
+        while covered < num_columns:
+            colspan = min(rng.randint(1, 3), num_columns - covered)
+            top_cells.append(f"<th colspan='{colspan}'>{_sentence(rng, words, 1, 3)}</th>")
+            covered += colspan
+        header_rows.append(f"<tr>{''.join(top_cells)}</tr>")
+    header_rows.append("<tr>" + "".join(f"<th>{_sentence(rng, words, 1, 3)}</th>" for _ in range(num_columns)) + "</tr>")
+
+    body_rows = []
+    spanned = [0] * num_columns  # remaining rows each column is covered by a rowspan
+    for _ in range(rng.randint(1, max_rows)):
+        cells = []
+        for col in range(num_columns):
+            if spanned[col] > 0:
+                spanned[col] -= 1
+                continue
+            if rng.random() < 0.05:
+                rowspan = rng.randint(2, 4)
+                spanned[col] = rowspan - 1
+                cells.append(f"<td rowspan='{rowspan}'>{_sentence(rng, words, 1, 5)}</td>")
+            else:
+                cells.append(f"<td>{_sentence(rng, words, 1, 5)}</td>")
+        body_rows.append(f"<tr>{''.join(cells)}</tr>")
+
+    return f"<table><tbody>{''.join(header_rows + body_rows)}</tbody></table>"
+
+
+def synthesize_page(content: str, rng: random.Random, words: List[str], max_table_rows: int = 200) -> str:
+    blocks = [content]
+    for _ in range(rng.randint(1, 4)):
+        blocks.append(_heading(rng, words))
+        for _ in range(rng.randint(1, 3)):
+            block = rng.choice(["paragraph", "paragraph", "list", "table"])
+            if block == "paragraph":
+                blocks.append(_paragraph(rng, words))
+            elif block == "list":
+                blocks.append(_nested_list(rng, words))
+            else:
+                # Mostly small tables, with the occasional large measurement table
+                rows = max_table_rows if rng.random() < 0.1 else max(1, max_table_rows // 20)
+                blocks.append(_table(rng, words, rows))
+    return "".join(blocks)
+
+
+def synthesize_corpus(documents: List[WebDocument], scale: int, seed: int = 0, max_table_rows: int = 200) -> List[WebDocument]:
+    words = [word for doc in documents for word in BeautifulSoup(doc.content, "html.parser").get_text(" ").split()
+             if word.isalnum()]
+
+    corpus = list(documents)
+    for copy_idx in range(1, scale):
+        for doc in documents:
+            rng = random.Random(f"{seed}-{copy_idx}-{doc.id}")
+            corpus.append(doc.model_copy(update={
+                "id": f"{doc.id}-synthetic-{copy_idx}",
+                "title": f"{doc.title} ({copy_idx})",
+                "url": f"{doc.url}?copy={copy_idx}",
+                "content": synthesize_page(doc.content, rng, words, max_table_rows),
+            }))
+    return corpus
+
+
+def run_scale(input_folder: Path, scale: int, seed: int, max_table_rows: int, verbalizer_config: VerbalizerConfig) -> Dict[str, Any]:
+    documents = synthesize_corpus(fetch_documents_from_folder(input_folder), scale, seed, max_table_rows)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = Path(tmp_dir)
+        start = time.perf_counter()
+        run_pipeline(
+            documents,
+            verbalizer_config,
+            out_dir=out_dir,
+            db_path=out_dir / "tables.db",
+            modalities=["all"],
+            incremental=False,
+            return_documents=False,
+        )
+        seconds = time.perf_counter() - start
+        timings = json.loads((out_dir / "timings.json").read_text(encoding="utf-8"))
+
+    return {
+        "scale": scale,
+        "pages": len(documents),
+        "passages": timings["counters"]["passages"],
+        "seconds": seconds,
+        "pages_per_second": len(documents) / seconds,
+        "passages_per_second": timings["counters"]["passages"] / seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # ru_maxrss is in KiB on Linux
+        "stages": {name: stage["wall"] for name, stage in timings["stages"].items()},
+        "counters": timings["counters"],
+    }
+
+
+def main(
+    scales: Optional[List[int]] = None,
+    input_folder: Path = Path("../confquestions/documents"),
+    verbalizer_config: Optional[VerbalizerConfig] = None,
+    max_table_rows: int = 200,
+    seed: int = 0,
+    output_file: Optional[Path] = None,
+):
+    scales = scales or [1, 10]
+    verbalizer_config = verbalizer_config or VerbalizerConfig(granularity=["all"])
+
+    results = []
+    for scale in scales:
+        # A fresh process per scale, so that the peak RSS is not carried over from the previous scale
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run_scale, input_folder, scale, seed, max_table_rows, verbalizer_config).result()
+        results.append(result)
+
+    print(10 * "=" + " PREPROCESSING BENCHMARK " + 10 * "=")
+    for result in results:
+        stages = ", ".join(f"{name}: {seconds:.2f}s" for name, seconds in
+                           sorted(result["stages"].items(), key=lambda item: item[1], reverse=True)
+                           if name != "total")
+        print(f"{result['scale']:>4}x | {result['pages']:>6} pages | {result['passages']:>8} passages | "
+              f"{result['seconds']:8.2f}s | {result['pages_per_second']:7.1f} pages/s | "
+              f"{result['passages_per_second']:8.1f} passages/s | peak RSS {result['peak_rss_mb']:.0f} MB")
+        print(f"       {stages}")
+
+    if output_file is not None:
+        output_file.write_text(json.dumps(results, indent=4), encoding="utf-8")
+        print(f"Benchmark results saved to: {output_file.resolve()}")
+
+
+if __name__ == "__main__":
+    from jsonargparse import CLI
+
+    CLI(main, as_positional=False)
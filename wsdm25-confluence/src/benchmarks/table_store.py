@@ -0,0 +1,75 @@
+"""
+Compares storing tables with one connection and commit per table (the former `store_table`, copied below as the
+baseline) against the shared, batched `TableStoreWriter` used by `run_pipeline`.
+
+Run from the `src` directory:
+    python -m benchmarks.table_store --num_tables 2000
+"""
+import json
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from preprocessing.utils import TableStoreWriter
+
+
+def baseline_store_table(db_path: Path, table_id: str, table_html, table_json: Optional[Dict[str, Any]] = None):
+    """ Verbatim copy of `store_table` before `TableStoreWriter`: one connection, lookup and commit per table. """
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+
+    c.execute('''CREATE TABLE IF NOT EXISTS tables
+                 (table_id TEXT PRIMARY KEY, table_html TEXT, table_json TEXT)''')
+
+    # Overwrite existing table if exists
+    c.execute('SELECT COUNT(*) FROM tables WHERE table_id = ?', (table_id,))
+    if c.fetchone()[0] > 0:
+        c.execute('DELETE FROM tables WHERE table_id = ?', (table_id,))
+
+    json_data = json.dumps(table_json) if table_json else None
+    c.execute('INSERT INTO tables (table_id, table_html, table_json) VALUES (?, ?, ?)', (table_id, table_html, json_data))
+
+    conn.commit()
+    conn.close()
+
+
+def _synthetic_table(table_idx: int, num_rows: int):
+    header = "Row ID | Machine | Result"
+    rows = [f"row_{i + 1:02} | Machine {table_idx}-{i} | passed" for i in range(num_rows)]
+    table_json = {"headers": ["Machine", "Result"], "rows": [[f"Machine {table_idx}-{i}", "passed"] for i in range(num_rows)]}
+    return "\n".join([header] + rows), table_json
+
+
+def main(num_tables: int = 2000, num_rows: int = 10, tables_per_document: int = 5):
+    tables = [(f"{i // tables_per_document:03}-{i}", *_synthetic_table(i, num_rows)) for i in range(num_tables)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(tmp_dir) / "per_table.db"
+        start = time.perf_counter()
+        for table_id, table_html, table_json in tables:
+            baseline_store_table(db_path, table_id, table_html, table_json=table_json)
+        per_table_seconds = time.perf_counter() - start
+
+        db_path = Path(tmp_dir) / "batched.db"
+        start = time.perf_counter()
+        with TableStoreWriter(db_path) as writer:
+            for idx, (table_id, table_html, table_json) in enumerate(tables, start=1):
+                writer.add(table_id, table_html, table_json=table_json)
+                if idx % tables_per_document == 0:
+                    writer.flush()  # run_pipeline commits once per document
+        batched_seconds = time.perf_counter() - start
+
+    print(f"Tables stored: {num_tables} ({tables_per_document} per document)")
+    print(f"Baseline store_table (connection + commit per table): {per_table_seconds:.3f}s "
+          f"({1000 * per_table_seconds / num_tables:.3f} ms/table)")
+    print(f"TableStoreWriter (shared connection, commit per document): {batched_seconds:.3f}s "
+          f"({1000 * batched_seconds / num_tables:.3f} ms/table)")
+    print(f"Speedup: {per_table_seconds / batched_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    from jsonargparse import CLI
+
+    CLI(main, as_positional=False)
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator, Literal, Optional
+
+
+class CompletionCacheMiss(KeyError):
+    """ Raised in replay mode for a prompt that is not in the cache. """
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Persistent SQLite cache of LLM completions, keyed by model, temperature, max_tokens and the hash of the prompt.
+
+    In "read_through" mode, cached completions are returned and all others are generated and added, so rerunning an
+    evaluation only sends the prompts that changed, e.g. after a retrieval-only change. In "replay" mode, nothing is
+    generated: every completion has to be cached, otherwise `CompletionCacheMiss` is raised. This replays an earlier
+    run deterministically, even at a temperature above zero.
+    The cache can be shared by several threads.
+    """
+    def __init__(self, db_path: Path, mode: Literal["read_through", "replay"] = "read_through"):
+        self.db_path = db_path
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS completions
+                     (completion_key TEXT PRIMARY KEY, model TEXT, completion TEXT)''')
+        self.conn.commit()
+
+    @staticmethod
+    def completion_key(model: str, temperature: Optional[float], max_tokens: Optional[int], prompt: str) -> str:
+        return _sha256(json.dumps([model, temperature, max_tokens, _sha256(prompt)]))
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT completion FROM completions WHERE completion_key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def add(self, key: str, model: str, completion: str):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completions (completion_key, model, completion) VALUES (?, ?, ?)",
+                (key, model, completion),
+            )
+            self.conn.commit()
+
+    def _lookup(self, key: str) -> Optional[str]:
+        completion = self.get(key)
+        with self._lock:
+            if completion is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if completion is None and self.mode == "replay":
+            raise CompletionCacheMiss(key)
+        return completion
+
+    def complete(
+        self,
+        model: str,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        prompt: str,
+        generate: Callable[[], str],
+    ) -> str:
+        """ Returns the cached completion of the prompt, or calls `generate` and caches its completion. """
+        key = self.completion_key(model, temperature, max_tokens, prompt)
+        completion = self._lookup(key)
+        if completion is None:
+            completion = generate()
+            self.add(key, model, completion)
+        return completion
+
+    async def acomplete(
+        self,
+        model: str,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        prompt: str,
+        generate: Callable[[], Awaitable[str]],
+    ) -> str:
+        """ Same as `complete`, but awaits `generate`. """
+        key = self.completion_key(model, temperature, max_tokens, prompt)
+        completion = self._lookup(key)
+        if completion is None:
+            completion = await generate()
+            self.add(key, model, completion)
+        return completion
+
+    def stream(
+        self,
+        model: str,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        prompt: str,
+        generate: Callable[[], Iterator[str]],
+    ) -> Iterator[str]:
+        """
+        Same as `complete`, but yields the completion in pieces: a cached completion at once, otherwise the pieces of
+        `generate` while they are generated. The completion is only cached once `generate` is exhausted.
+        """
+        key = self.completion_key(model, temperature, max_tokens, prompt)
+        completion = self._lookup(key)
+        if completion is not None:
+            yield completion
+            return
+        parts = []
+        for text in generate():
+            parts.append(text)
+            yield text
+        self.add(key, model, "".join(parts))
+
+    def summary(self) -> str:
+        return f"{self.hits} cached completions, {self.misses} generated"
+
+    def close(self):
+        self.conn.close()
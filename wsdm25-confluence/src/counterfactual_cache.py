@@ -0,0 +1,79 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from models.data import Document
+from utils import build_prompt
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CounterfactualCache:
+    """
+    Persistent SQLite cache of the answers generated during attribution and of their embeddings.
+
+    Answers are keyed by model, temperature and the hash of the prompt, i.e. the question and the evidences (titles,
+    positions and the contents left in the prompt), so re-asking a question over the same evidences, e.g. when an
+    evaluation is repeated, reuses the counterfactual answers of earlier runs instead of calling the LLM again.
+    Embeddings are keyed by the embedding model and the answer text.
+    The cache can be shared by attributions running on several threads.
+    """
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS answers (answer_key TEXT PRIMARY KEY, answer TEXT)''')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS embeddings
+                     (embedding_key TEXT PRIMARY KEY, embedding BLOB)''')
+        self.conn.commit()
+
+    @staticmethod
+    def answer_key(model: str, temperature: float, question: str, evidences: List[Document],
+                   mask: Optional[List[bool]] = None) -> str:
+        return _sha256(json.dumps([model, temperature, _sha256(build_prompt(question, evidences, mask))]))
+
+    @staticmethod
+    def embedding_key(model: str, text: str) -> str:
+        return _sha256(json.dumps([model, text]))
+
+    def get_answers(self, keys: List[str]) -> List[Optional[str]]:
+        with self._lock:
+            answers = dict(self.conn.execute(
+                f"SELECT answer_key, answer FROM answers WHERE answer_key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall())
+        return [answers.get(key) for key in keys]
+
+    def add_answers(self, keys: List[str], answers: List[str]):
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO answers (answer_key, answer) VALUES (?, ?)", list(zip(keys, answers))
+            )
+            self.conn.commit()
+
+    def get_embeddings(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [self.embedding_key(model, text) for text in texts]
+        with self._lock:
+            embeddings = dict(self.conn.execute(
+                f"SELECT embedding_key, embedding FROM embeddings WHERE embedding_key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall())
+        return [np.frombuffer(embeddings[key], dtype=np.float64) if key in embeddings else None for key in keys]
+
+    def add_embeddings(self, model: str, texts: List[str], embeddings: List[np.ndarray]):
+        rows = [(self.embedding_key(model, text), np.asarray(embedding, dtype=np.float64).tobytes())
+                for text, embedding in zip(texts, embeddings)]
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings (embedding_key, embedding) VALUES (?, ?)", rows)
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
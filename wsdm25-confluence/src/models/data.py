@@ -1,4 +1,4 @@
-from typing import Any, Dict, List, Literal, Optional, Union
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
 
 from pydantic import BaseModel
 
@@ -13,6 +13,7 @@ class Table(BaseModel):
 class TableAttachment(BaseModel):
     id: str
     row: Optional[int] = None
+    row_range: Optional[Tuple[int, int]] = None  # First and last row (inclusive) of a row window
     table: Optional[Table] = None
     type: Literal["table"] = "table"
 
@@ -6,9 +6,12 @@ from models.data import Document
 from preprocessing.embedding import (
     batch_embed_documents,
     get_openai_api_key,
+    load_documents,
     save_documents,
 )
-from preprocessing.heterogenous_data.entrypoint import run_pipeline
+from preprocessing.heterogenous_data.entrypoint import run_pipeline, run_pipeline_grid
+from preprocessing.heterogenous_data.manifest import load_delta
+from preprocessing.knn_graph import KnnGraph
 from preprocessing.model import MultiModalConfig, VerbalizerDocument
 
 
@@ -29,14 +32,77 @@ def fetch_documents_from_folder(folder_path: Path) -> List[WebDocument]:
     return documents
 
 
+def reuse_embeddings(
+    documents: List[Document], embedded_documents: List[Document], added_ids: List[str]
+) -> List[Document]:
+    """
+    Copies the embeddings of unchanged passages from a previous run.
+    Returns the documents that still need to be embedded.
+    """
+    previous_embeddings = {doc.id: doc.embedding for doc in embedded_documents if doc.embedding is not None}
+    added = set(added_ids)
+
+    documents_to_embed = []
+    for doc in documents:
+        if doc.id not in added and doc.id in previous_embeddings:
+            doc.embedding = previous_embeddings[doc.id]
+        else:
+            documents_to_embed.append(doc)
+    return documents_to_embed
+
+
+def embed_collection(verbalized_documents: List[Document], out_dir: Path, incremental: bool = False):
+    embedded_documents_file = Path(out_dir / "embedded_documents.npy")
+
+    documents_to_embed = verbalized_documents
+    delta = load_delta(out_dir)
+    if incremental and embedded_documents_file.exists() and delta is not None:
+        documents_to_embed = reuse_embeddings(
+            verbalized_documents, load_documents(embedded_documents_file), delta["added"]
+        )
+        print(f"Reusing embeddings of {len(verbalized_documents) - len(documents_to_embed)} documents.")
+
+    batch_embed_documents(documents_to_embed)
+    save_documents(verbalized_documents, embedded_documents_file)
+    KnnGraph.build(verbalized_documents).save(out_dir)
+
+
 def prepare(
     multi_modal_config: MultiModalConfig,
     out_dir: Path = Path("out/confluence-openxt"),
     input_folder: Path = Path("confquestions/documents"),
+    incremental: bool = False,
+    debug_mode: bool = False,
 ):
+    """
+    If `incremental` is set and the embedded documents file already exists, only new and changed documents are
+    processed and embedded; the embeddings of all other passages are reused.
+    If `debug_mode` is set, an HTML report of the extracted passages is written to `debug_output` of each collection.
+    If several modes are configured, the pages are processed once for all of them and each mode gets its own
+    collection (including `embedded_documents.npy`) in a subfolder of `out_dir`.
+    """
     embedded_documents_file = Path(out_dir / "embedded_documents.npy")
+    verbalizer_config = multi_modal_config.verbalizer_config
 
-    if not embedded_documents_file.exists():
+    if len(verbalizer_config.mode) > 1:
+        get_openai_api_key()
+
+        documents = fetch_documents_from_folder(input_folder)
+        collections = run_pipeline_grid(
+            documents,
+            verbalizer_configs=[verbalizer_config],
+            out_dir=out_dir,
+            modalities=multi_modal_config.modalities,
+            debug_mode=debug_mode,
+            incremental=incremental,
+        )
+        for name, verbalized_documents in collections.items():
+            if (out_dir / name / "embedded_documents.npy").exists() and not incremental:
+                print(f"Collection `{name}` has already been embedded, skipping it.")
+                continue
+            embed_collection(verbalized_documents, out_dir / name, incremental)
+
+    elif not embedded_documents_file.exists() or incremental:
         get_openai_api_key()
 
         documents = fetch_documents_from_folder(input_folder)
@@ -44,17 +110,17 @@ def prepare(
             documents,
             db_path=None,
             out_dir=out_dir,
-            verbalizer_config=multi_modal_config.verbalizer_config,
+            verbalizer_config=verbalizer_config,
             modalities=multi_modal_config.modalities,
+            debug_mode=debug_mode,
+            incremental=incremental,
         )
-
-        batch_embed_documents(verbalized_documents)
-        save_documents(verbalized_documents, embedded_documents_file)
+        embed_collection(verbalized_documents, out_dir, incremental)
 
     else:
         print(
             f"Embedded documents file `{embedded_documents_file}` already exists. You can start chatting."
-            f"To embedd new documents, please delete the file first or specify another out_dir."
+            f"To embedd new documents, please delete the file first, specify another out_dir or use --incremental."
         )
 
 
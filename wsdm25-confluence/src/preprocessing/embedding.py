@@ -1,10 +1,10 @@
 import os
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 from models.data import Document
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
 
 def get_openai_api_key():
@@ -27,7 +27,7 @@ def batch_embed_documents(
         print(f"Embedding batch {int(i//batch_size) + 1}")
         batch = documents[i : i + batch_size]
 
-        contents = []
+        embedded_docs = []
         for doc in batch:
             token_estimate = (
                 len(doc.content) // 4
@@ -35,16 +35,17 @@ def batch_embed_documents(
             if token_estimate > max_tokens:
                 print(f"Skipping document ID {doc.id}: exceeds {max_tokens} tokens.")
                 continue
-            contents.append(doc.content)
+            embedded_docs.append(doc)
 
-        if not contents:
+        if not embedded_docs:
             print("No documents in this batch fit within the token limit.")
             continue
 
-        response = client.embeddings.create(model=model, input=contents)
+        response = client.embeddings.create(model=model, input=[doc.content for doc in embedded_docs])
         embeddings = [item.embedding for item in response.data]
 
-        for doc, embedding in zip(batch, embeddings):
+        # Skipped documents keep no embedding, so we must only pair the documents that were actually sent
+        for doc, embedding in zip(embedded_docs, embeddings):
             doc.embedding = np.array(embedding)
 
 
@@ -57,9 +58,60 @@ def embed_text(
     return np.array(response.data[0].embedding)
 
 
+def embed_texts(
+    texts: List[str],
+    model: str = "text-embedding-3-small",
+) -> List[np.ndarray]:
+    """ Embeds several texts with a single request; the embeddings are returned in the order of the texts. """
+    if not texts:
+        return []
+    client = OpenAI()
+    response = client.embeddings.create(model=model, input=texts)
+    return [np.array(item.embedding) for item in sorted(response.data, key=lambda item: item.index)]
+
+
+async def async_embed_text(
+    text: str,
+    model: str = "text-embedding-3-small",
+    client: Optional[AsyncOpenAI] = None,
+) -> np.ndarray:
+    """
+    Same as `embed_text`, but awaitable. Pass a shared `client` to reuse its connections, otherwise a new client is
+    created (and closed) for this request.
+    """
+    if client is None:
+        async with AsyncOpenAI() as client:
+            return await async_embed_text(text, model, client)
+    response = await client.embeddings.create(model=model, input=text)
+    return np.array(response.data[0].embedding)
+
+
+async def async_embed_texts(
+    texts: List[str],
+    model: str = "text-embedding-3-small",
+    client: Optional[AsyncOpenAI] = None,
+) -> List[np.ndarray]:
+    """
+    Same as `embed_texts`, but awaitable. Pass a shared `client` to reuse its connections, otherwise a new client is
+    created (and closed) for this request.
+    """
+    if not texts:
+        return []
+    if client is None:
+        async with AsyncOpenAI() as client:
+            return await async_embed_texts(texts, model, client)
+    response = await client.embeddings.create(model=model, input=texts)
+    return [np.array(item.embedding) for item in sorted(response.data, key=lambda item: item.index)]
+
+
 def vector_search(
     query_embed: np.ndarray, embeddings: np.ndarray, top_k: int = 3
 ) -> List[int]:
+    similarities = cosine_similarities(query_embed, embeddings)
+    return np.argsort(-similarities)[:top_k]
+
+
+def cosine_similarities(query_embed: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
     if query_embed is None or not isinstance(query_embed, np.ndarray):
         raise ValueError("query_embed must be a non-None numpy array.")
 
@@ -80,8 +132,7 @@ def vector_search(
             "Normalization failed; embeddings may contain zero vectors or invalid values."
         )
 
-    similarities = docs_norm @ query_norm
-    return np.argsort(-similarities)[:top_k]
+    return docs_norm @ query_norm
 
 
 def save_documents(documents: List[Document], out_file: Path):
@@ -0,0 +1,149 @@
+import hashlib
+import html
+import re
+from collections import Counter, defaultdict
+from dataclasses import replace
+from typing import List, Tuple, Optional
+
+from models.data import Document
+from preprocessing.model import Passage
+
+# Only block-level elements start a new line; inline tags (links, emphasis, ...) are part of the line
+block_tag_pattern = re.compile(r'</?(?:p|li|div|h[1-6]|tr|br)\b[^>]*>', re.IGNORECASE)
+tag_pattern = re.compile(r'<[^>]+>')
+
+# Dates, numbers, e-mail addresses and the names after "by" vary between the pages and are replaced by placeholders
+# in the templates
+_month = r'(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?'
+_date = rf'(?:{_month}\s+\d{{1,2}},?\s+\d{{4}}|\d{{4}}-\d{{2}}-\d{{2}}|\d{{1,2}}[./]\d{{1,2}}[./]\d{{2,4}})'
+_number = r'\b\d+(?:[.,:]\d+)*\b'
+_email = r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+'
+# Up to four capitalized words, on the same line
+_name = r"[A-Z][\w'.-]*(?:[^\S\n]+[A-Z][\w'.-]*){0,3}"
+# Names that were not seen while fitting only match at the end of a line, so that the capitalized words following
+# a name in a passage (e.g. a heading) are not stripped with it
+_unseen_name = r"[A-Z][\w'.-]*(?:[^\S\n]+[A-Z][\w'.-]*)?(?=[^\S\n]*(?:\n|\Z))"
+date_pattern = re.compile(_date)
+email_pattern = re.compile(_email)
+number_pattern = re.compile(_number)
+name_pattern = re.compile(rf'(?<=\b[Bb]y ){_name}')
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def _template_and_names(line: str) -> Tuple[str, List[str]]:
+    line = email_pattern.sub('<EMAIL>', _normalize(line))
+    line = date_pattern.sub('<DATE>', line)
+    line = number_pattern.sub('<NUMBER>', line)
+    return name_pattern.sub('<NAME>', line), name_pattern.findall(line)
+
+
+def line_template(line: str) -> str:
+    """ The normalized line with dates, numbers, e-mail addresses and names after "by" replaced by placeholders. """
+    return _template_and_names(line)[0]
+
+
+def template_regex(template: str, names: List[str]) -> str:
+    """
+    A regex matching the lines of the template; words may be separated by any whitespace.
+    Its name placeholders match the given `names` or a name that was not seen at the end of a line.
+    """
+    name_regex = '|'.join([r'\s+'.join(map(re.escape, name.split())) for name in sorted(names, key=len, reverse=True)]
+                          + [_unseen_name])
+    regex = r'\s+'.join(map(re.escape, template.split()))
+    for placeholder, pattern in (('<DATE>', _date), ('<NUMBER>', _number), ('<EMAIL>', _email), ('<NAME>', name_regex)):
+        regex = regex.replace(re.escape(placeholder), f'(?:{pattern})')
+    return regex
+
+
+class BoilerplateDetector:
+    """
+    Finds lines that are repeated across many documents of a corpus, e.g. "Owned by ..." and
+    "Last updated: ... by ..." headers or license notes of Confluence pages, and strips them from passages.
+
+    Lines are compared by their template (see `line_template`), in which dates, numbers, e-mail addresses and the
+    names after "by" are replaced by placeholders, so that e.g. "Owned by Jane Doe" and "Owned by John Roe" are
+    variants of the template "Owned by <NAME>". A template is boilerplate if it has at least `min_words` words (two of
+    which are not placeholders) and occurs in at least `min_document_ratio` of the documents (and in at least
+    `min_documents` documents). Its placeholders match any date, number or address and the names seen in the
+    boilerplate lines (other names only at the end of a line), so variants that were not seen are stripped as well.
+    Detection runs on the raw HTML with tags stripped, so it does not need a parsing pass of its own.
+    """
+    def __init__(self, min_document_ratio: float = 0.05, min_documents: int = 3, min_words: int = 3):
+        self.min_document_ratio = min_document_ratio
+        self.min_documents = min_documents
+        self.min_words = min_words
+        self.templates: List[str] = []
+        self.names: List[str] = []
+        self.pattern: Optional[re.Pattern] = None
+
+    def fit(self, documents: List[Document]) -> "BoilerplateDetector":
+        document_frequency = Counter()
+        names_per_template = defaultdict(set)
+        for document in documents:
+            text = html.unescape(tag_pattern.sub('', block_tag_pattern.sub('\n', document.content)))
+            templates = set()
+            for line in text.split('\n'):
+                template, names = _template_and_names(line)
+                if self._is_candidate(template):
+                    templates.add(template)
+                    names_per_template[template].update(names)
+            document_frequency.update(templates)
+
+        threshold = max(self.min_documents, self.min_document_ratio * len(documents))
+        self.templates = sorted(template for template, count in document_frequency.items() if count >= threshold)
+        self.names = sorted({name for template in self.templates for name in names_per_template[template]})
+
+        if self.templates:
+            # Longest templates first, so that a line is not only partially stripped because a shorter one matched
+            alternatives = '|'.join(template_regex(template, self.names)
+                                    for template in sorted(self.templates, key=len, reverse=True))
+            # A span filling a whole line is removed with its line break, any other span with the spaces after it
+            self.pattern = re.compile(rf'^[^\S\n]*(?P<line>{alternatives})[^\S\n]*(?:\n|\Z)'
+                                      rf'|(?<!\S)(?P<span>{alternatives})(?!\S)[^\S\n]*', re.MULTILINE)
+        return self
+
+    def _is_candidate(self, template: str) -> bool:
+        words = template.split()
+        return len(words) >= self.min_words and sum(not word.startswith('<') for word in words) >= 2
+
+    def fingerprint(self) -> str:
+        return hashlib.sha256('\n'.join(self.templates + self.names).encode('utf-8')).hexdigest()
+
+    def strip(self, text: str) -> Tuple[str, List[str]]:
+        """
+        Returns the text without boilerplate and the (normalized) stripped spans.
+        Only the spans are removed, the remaining text keeps its whitespace and line breaks.
+        """
+        if not self.pattern or not text:
+            return text, []
+        stripped = [_normalize(match.group("line") or match.group("span")) for match in self.pattern.finditer(text)]
+        if not stripped:
+            return text, []
+        return self.pattern.sub('', text).strip(), stripped
+
+    def strip_passages(self, passages: List[Passage]) -> List[Passage]:
+        """
+        Strips boilerplate from the content and contexts of text and list passages; tables are not touched.
+        Passages with boilerplate are returned as copies with the stripped spans recorded in their metadata, the given
+        passages are not modified. Passages that consisted of boilerplate only are dropped.
+        """
+        stripped_passages = []
+        for passage in passages:
+            if passage.is_table or passage.is_table_row:
+                stripped_passages.append(passage)
+                continue
+
+            content, stripped = self.strip(passage.content)
+            ctx_before, stripped_before = self.strip(passage.ctx_before)
+            ctx_after, stripped_after = self.strip(passage.ctx_after)
+
+            if stripped or stripped_before or stripped_after:
+                metadata = {**passage.metadata, "stripped_boilerplate": stripped + stripped_before + stripped_after}
+                passage = replace(passage, content=content, ctx_before=ctx_before, ctx_after=ctx_after,
+                                  metadata=metadata)
+            if passage.content:
+                stripped_passages.append(passage)
+        return stripped_passages
@@ -1,13 +1,18 @@
 import json
+from dataclasses import replace
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Dict
 from preprocessing.heterogenous_data.extractor import parse_html_content, PassageExtractor
+from preprocessing.heterogenous_data.processors.table_processor import TableProcessor
 from models.data import Document
 
-from preprocessing.utils import generate_heterogenous_processing_summary_from_passages
+from preprocessing.utils import ProcessingSummary, TableStoreWriter, save_config_as_json
 
-from preprocessing.model import Passage
+from preprocessing.model import Passage, VerbalizerConfig, MultiModalConfig
+from preprocessing.instrumentation import PipelineProfiler
 from preprocessing.heterogenous_data.contextualization import assemble_passage_text
+from preprocessing.heterogenous_data.manifest import PreprocessingManifest, hash_config
+from preprocessing.heterogenous_data.boilerplate import BoilerplateDetector
 
 
 def run_pipeline(
@@ -16,64 +21,288 @@ def run_pipeline(
     out_dir: Path,
     db_path: Optional[Path] = None,
     modalities: Optional[List] = None,
-    debug_mode: bool = True
-) -> List[Document]:
+    debug_mode: bool = False,
+    incremental: bool = False,
+    profile_document_id: Optional[str] = None,
+    return_documents: bool = True,
+) -> Optional[List[Document]]:
     """
     Processes documents, extracts passages, and optionally generates an HTML debugging report.
     Each passage becomes a separate document with a unique ID.
+    Processed documents are streamed to `processed_documents.jsonl` while they are produced, and the debugging report
+    is written page by page (one HTML file per document, linked from `debug_output/index.html`).
+    If `incremental` is set, documents that did not change since the last run into `out_dir` are not parsed again;
+    their cached passages are reused and the added/removed passage ids are written to `delta.json`.
+    Only the first mode of the verbalizer config is used, see `run_pipeline_grid` for processing several modes.
+    Time spent per stage and per document is appended to `summary.txt` and written to `timings.json`;
+    the document with the id `profile_document_id` is additionally profiled with cProfile.
+    If `boilerplate_min_document_ratio` is set in the verbalizer config, lines repeated across that share of documents
+    are stripped from the passages before they are assembled; the stripped spans are kept in the document metadata.
+    The processed documents are only kept in memory and returned if `return_documents` is set (e.g. for embedding
+    them); otherwise, memory does not grow with the corpus and None is returned.
     """
-    processed_documents = []
-    passage_container = []
-    html_content = _build_html_header() if debug_mode else []
+    profiler = PipelineProfiler(profile_document_id)
+    with profiler.stage("boilerplate_detection"):
+        boilerplate = fit_boilerplate_detector(documents, verbalizer_config)
+    collection = OutputCollection(verbalizer_config, out_dir, modalities, db_path, debug_mode, incremental, profiler,
+                                  boilerplate, return_documents)
+    try:
+        _process_documents(documents, [collection], modalities, profiler)
+    except BaseException:
+        collection.abort()
+        raise
+    return collection.close()
 
-    for document_idx, document in enumerate(documents):
-        soup = parse_html_content(document.content)
 
-        extractor = PassageExtractor(verbalizer_config, document, modalities, db_path)
-        passages = extractor.extract_passages(soup)
+def run_pipeline_grid(
+    documents: List[Document],
+    verbalizer_configs: List[VerbalizerConfig],
+    out_dir: Path,
+    modalities: Optional[List] = None,
+    store_tables: bool = False,
+    debug_mode: bool = False,
+    incremental: bool = False,
+    profile_document_id: Optional[str] = None,
+    return_documents: bool = True,
+) -> Dict[str, Optional[List[Document]]]:
+    """
+    Processes documents for several verbalizer configurations at once, e.g. to evaluate different table representations.
+    Configurations with several modes are split up into one configuration per mode.
+    Each page is parsed and walked only once; only the tables are rendered per configuration.
+
+    Every configuration gets its own output collection in `out_dir / <collection name>` with the same files as
+    `run_pipeline`, plus the `multi_modal_config.json` expected by the `document_database_grid` of the evaluation.
+    If `store_tables` is set, each collection stores its tables in its own `tables.db`.
+    The timings of each collection show the shared stages (e.g. parsing and walking the pages) and its own stages and
+    counters (e.g. its passages), see `PipelineProfiler.child`.
+
+    Returns:
+        Dict[str, Optional[List[Document]]]: The processed documents per collection name (None unless
+        `return_documents` is set, see `run_pipeline`).
+    """
+    profiler = PipelineProfiler(profile_document_id)
+    collections = {}
+    boilerplate_detectors = {}
+    for verbalizer_config in expand_verbalizer_configs(verbalizer_configs):
+        name = collection_name(verbalizer_config, modalities)
+        count = 1
+        while name in collections:
+            name = f"{collection_name(verbalizer_config, modalities)}_{count}"
+            count += 1
+
+        collection_dir = out_dir / name
+        collection_dir.mkdir(parents=True, exist_ok=True)
+        save_config_as_json(collection_dir, MultiModalConfig(verbalizer_config=verbalizer_config, modalities=modalities))
+
+        ratio = verbalizer_config.boilerplate_min_document_ratio
+        if ratio not in boilerplate_detectors:
+            with profiler.stage("boilerplate_detection"):
+                boilerplate_detectors[ratio] = fit_boilerplate_detector(documents, verbalizer_config)
+
+        db_path = collection_dir / "tables.db" if store_tables else None
+        collections[name] = OutputCollection(verbalizer_config, collection_dir, modalities, db_path, debug_mode, incremental,
+                                             profiler.child(), boilerplate_detectors[ratio], return_documents)
+
+    try:
+        _process_documents(documents, list(collections.values()), modalities, profiler)
+    except BaseException:
+        for collection in collections.values():
+            collection.abort()
+        raise
+    return {name: collection.close() for name, collection in collections.items()}
+
+
+def expand_verbalizer_configs(verbalizer_configs: List[VerbalizerConfig]) -> List[VerbalizerConfig]:
+    return [replace(config, mode=[mode]) for config in verbalizer_configs for mode in config.mode]
+
+
+def collection_name(verbalizer_config: VerbalizerConfig, modalities: Optional[List]) -> str:
+    # Same naming scheme as `readable_config_string` of the evaluation
+    mode = "-".join(verbalizer_config.mode)
+    granularity = "-".join(verbalizer_config.granularity)
+    modalities_str = "-".join(modalities or [])
+    return f"{mode}_{granularity}_{modalities_str}".replace(" ", "-").lower()
+
+
+def fit_boilerplate_detector(documents: List[Document], verbalizer_config: VerbalizerConfig) -> Optional[BoilerplateDetector]:
+    if verbalizer_config.boilerplate_min_document_ratio is None:
+        return None
+    return BoilerplateDetector(min_document_ratio=verbalizer_config.boilerplate_min_document_ratio).fit(documents)
+
+
+def _process_documents(documents: List[Document], collections: List["OutputCollection"], modalities: Optional[List],
+                       profiler: PipelineProfiler):
+    with profiler.stage("total"):
+        for document in documents:
+            with profiler.document(document.id):
+                _process_document(document, collections, modalities, profiler)
+
+
+def _process_document(document: Document, collections: List["OutputCollection"], modalities: Optional[List],
+                      profiler: PipelineProfiler):
+    with profiler.stage("passage_cache"):
+        passages_per_collection = [
+            collection.manifest.get_cached_passages(document) if collection.manifest else None
+            for collection in collections
+        ]
+    pending = [idx for idx, passages in enumerate(passages_per_collection) if passages is None]
+
+    if pending:
+        with profiler.stage("html_parsing"):
+            soup = parse_html_content(document.content)
+
+        extractor = PassageExtractor(collections[pending[0]].verbalizer_config, document, modalities, profiler=profiler)
+        with profiler.stage("dom_walk"):
+            extracted = extractor.extract_passages_for_configs(
+                soup,
+                [collections[idx].verbalizer_config for idx in pending],
+                [TableProcessor(table_store=collections[idx].table_store, profiler=collections[idx].profiler) for idx in pending],
+            )
+
+        for idx, passages in zip(pending, extracted):
+            collection = collections[idx]
+            if collection.boilerplate:
+                with collection.profiler.stage("boilerplate_stripping"):
+                    passages = collection.boilerplate.strip_passages(passages)
+
+            with collection.profiler.stage("passage_assembly"):
+                for passage in passages:
+                    if document.space:
+                        passage.space = document.space
+                    assemble_passage_text(passage, collection.verbalizer_config.context_mode)
+
+            if collection.manifest:
+                with collection.profiler.stage("passage_cache"):
+                    collection.manifest.store(document, passages)
+            passages_per_collection[idx] = passages
+    else:
+        profiler.count("cached_documents")
+
+    for collection, passages in zip(collections, passages_per_collection):
+        collection.add_document(document, passages)
+
 
-        if document.space:
-            for psg in passages:
-                psg.space = document.space
-        passage_container.extend(passages)
+class OutputCollection:
+    """
+    The outputs of one verbalizer configuration: processed documents, summary, table store, manifest and debug report.
+    """
+    def __init__(self, verbalizer_config: VerbalizerConfig, out_dir: Path, modalities: Optional[List] = None,
+                 db_path: Optional[Path] = None, debug_mode: bool = False, incremental: bool = False,
+                 profiler: Optional[PipelineProfiler] = None, boilerplate: Optional[BoilerplateDetector] = None,
+                 return_documents: bool = True):
+        self.verbalizer_config = verbalizer_config
+        self.profiler = profiler or PipelineProfiler()
+        self.boilerplate = boilerplate
+        if boilerplate:
+            self.profiler.count("boilerplate_templates", len(boilerplate.templates))
+        self.out_dir = out_dir
+        # Only kept if the caller needs them; the summary is computed while the passages are added
+        self.processed_documents: Optional[List[Document]] = [] if return_documents else None
+        self.summary = ProcessingSummary()
+        self.document_count = 0
+
+        out_dir.mkdir(parents=True, exist_ok=True)
+        self.documents_output_path = out_dir / "processed_documents.jsonl"
+        self.documents_output = self.documents_output_path.open("w", encoding="utf-8")
+        self.debug_report = DebugReportWriter(out_dir / "debug_output", verbalizer_config.context_mode) if debug_mode else None
+        self.table_store = TableStoreWriter(db_path) if db_path else None
+        config_hash = hash_config(verbalizer_config, modalities, db_path, boilerplate.fingerprint() if boilerplate else None)
+        self.manifest = PreprocessingManifest(out_dir, config_hash) if incremental else None
 
+    def add_document(self, document: Document, passages: List[Passage]):
+        with self.profiler.stage("output"):
+            self._add_document(document, passages)
+        self.profiler.count("passages", len(passages))
+
+    def _add_document(self, document: Document, passages: List[Passage]):
         for passage in passages:
-            passage = assemble_passage_text(passage, verbalizer_config.context_mode)
-            processed_documents.append(
-                Document(
-                    id=passage.passage_id,
-                    title=passage.page_title,
-                    content=passage.content,
-                    url=document.url,
-                    attachment=passage.attachment,
-                )
+            self.summary.add(passage)
+            processed_document = Document(
+                id=passage.passage_id,
+                title=passage.page_title,
+                content=passage.content,
+                url=document.url,
+                attachment=passage.attachment,
+                metadata=passage.metadata or None,
             )
+            self.document_count += 1
+            if self.processed_documents is not None:
+                self.processed_documents.append(processed_document)
+            self.documents_output.write(json.dumps(processed_document.model_dump(), ensure_ascii=False) + "\n")
+
+        if self.table_store:
+            with self.profiler.stage("sqlite_writes"):
+                self.table_store.flush()
+
+        if self.debug_report:
+            self.debug_report.add_document(document, passages)
 
-        if debug_mode:
-            html_content.extend(generate_page_debugging_content(document, passages, verbalizer_config.context_mode))
+    def abort(self):
+        """ Releases the table store and the output files after a failed run, without writing summary or manifest. """
+        self.documents_output.close()
+        if self.table_store:
+            self.table_store.close()
+        if self.debug_report:
+            self.debug_report.close()
 
-    summary_text = generate_heterogenous_processing_summary_from_passages(passage_container, len(processed_documents))
+    def close(self) -> Optional[List[Document]]:
+        self.documents_output.close()
+
+        if self.table_store:
+            self.table_store.close()
+
+        if self.manifest:
+            self.manifest.save()
+
+        summary_text = self.summary.text(self.document_count)
+        timing_text = self.profiler.summary_text()
+        print(timing_text)
+
+        summary_output_path = self.out_dir / "summary.txt"
+        summary_output_path.write_text(summary_text + "\n" + timing_text, encoding="utf-8")
+        self.profiler.save(self.out_dir)
+
+        if self.debug_report:
+            debug_output_path = self.debug_report.close()
+            print(f"Debugging HTML report generated at: {debug_output_path.resolve()}")
+            print("Open this file in your browser to inspect the passages.")
+
+        print(f"Processed documents saved to: {self.documents_output_path.resolve()}")
+        print(f"Summary report saved to: {summary_output_path.resolve()}")
+
+        return self.processed_documents
+
+
+class DebugReportWriter:
+    """
+    Writes the HTML debugging report incrementally: one page per document plus an index linking all pages.
+    """
+    def __init__(self, report_dir: Path, context_mode: List[str]):
+        self.report_dir = report_dir
+        self.context_mode = context_mode
+        self.page_count = 0
 
-    out_dir.mkdir(parents=True, exist_ok=True)
-    documents_output_path = out_dir / "processed_documents.json"
-    with documents_output_path.open("w", encoding="utf-8") as f:
-        json.dump([doc.dict() for doc in processed_documents], f, ensure_ascii=False, indent=4)
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.report_dir / "index.html"
+        self.index = self.index_path.open("w", encoding="utf-8")
+        self.index.write("\n".join(_build_html_header() + ["<ol>"]) + "\n")
 
-    summary_output_path = out_dir / "summary.txt"
-    summary_output_path.write_text(summary_text, encoding="utf-8")
+    def add_document(self, document: Document, passages: List[Passage]):
+        self.page_count += 1
+        page_name = f"{self.page_count:05}.html"
 
-    if debug_mode:
-        html_content.append("</body>")
-        html_content.append("</html>")
-        debug_output_path = out_dir / "debug_output.html"
-        debug_output_path.write_text("\n".join(html_content), encoding="utf-8")
-        print(f"Debugging HTML report generated at: {debug_output_path.resolve()}")
-        print("Open this file in your browser to inspect the passages.")
+        page_content = _build_html_header()
+        page_content.append("<p><a href='index.html'>Back to index</a></p>")
+        page_content.extend(generate_page_debugging_content(document, passages, self.context_mode))
+        page_content.extend(["</body>", "</html>"])
+        (self.report_dir / page_name).write_text("\n".join(page_content), encoding="utf-8")
 
-    print(f"Processed documents saved to: {documents_output_path.resolve()}")
-    print(f"Summary report saved to: {summary_output_path.resolve()}")
+        self.index.write(f"<li><a href='{page_name}'>{document.id}: {document.title}</a> ({len(passages)} passages)</li>\n")
 
-    return processed_documents
+    def close(self) -> Path:
+        self.index.write("</ol>\n</body>\n</html>\n")
+        self.index.close()
+        return self.index_path
 
 
 def _build_html_header() -> List[str]:
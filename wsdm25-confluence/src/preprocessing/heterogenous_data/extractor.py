@@ -1,4 +1,5 @@
-from pathlib import Path
+import copy
+from dataclasses import replace
 from typing import List, Optional
 
 from bs4 import BeautifulSoup, Tag
@@ -7,23 +8,28 @@ from preprocessing.heterogenous_data.processors.content_processor import Content
 from preprocessing.heterogenous_data.processors.header_processor import HeaderProcessor
 from preprocessing.heterogenous_data.processors.list_processor import ListProcessor
 from preprocessing.heterogenous_data.processors.table_processor import TableProcessor
+from preprocessing.heterogenous_data.verbalization import TableGrid
 from preprocessing.model import Passage
 from preprocessing.heterogenous_data.contextualization import Contextualizer
 
 from preprocessing.model import VerbalizerConfig
+from preprocessing.utils import TableStoreWriter
+from preprocessing.instrumentation import PipelineProfiler
 from models.data import Document
 
 header_tags = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
 
 
 class PassageExtractor:
-    def __init__(self, verbalizer_config: VerbalizerConfig, document: Document, modalities: List[str], db_path: Optional[Path] = None):
+    def __init__(self, verbalizer_config: VerbalizerConfig, document: Document, modalities: List[str], table_store: Optional[TableStoreWriter] = None,
+                 profiler: Optional[PipelineProfiler] = None):
         self.verbalizer_config = verbalizer_config
         self.document = document
+        self.profiler = profiler or PipelineProfiler()
 
         self.header_processor = HeaderProcessor()
         self.list_processor = ListProcessor()
-        self.table_processor = TableProcessor(db_path=db_path)
+        self.table_processor = TableProcessor(table_store=table_store, profiler=self.profiler)
         self.content_processor = ContentProcessor()
 
         self.contextualizer = None
@@ -35,14 +41,32 @@ class PassageExtractor:
             self.allowed_modalities = {"passage"}  # Include only passages (no tables or lists)
 
     def extract_passages(self, soup: BeautifulSoup) -> List[Passage]:
-        passages = []
+        return self.extract_passages_for_configs(soup, [self.verbalizer_config], [self.table_processor])[0]
+
+    def extract_passages_for_configs(self, soup: BeautifulSoup, verbalizer_configs: List[VerbalizerConfig],
+                                     table_processors: Optional[List[TableProcessor]] = None) -> List[List[Passage]]:
+        """
+        Walks the DOM once and extracts the passages for each of the given verbalizer configs.
+        Text passages and lists are extracted once and copied for each config, only tables are rendered per config.
+        As the passage ids are running numbers, each config keeps its own passage list.
+        Contexts are collected with one contextualizer per distinct `context_mode`.
+        """
+        table_processors = table_processors or [self.table_processor] * len(verbalizer_configs)
+        passages_per_config = [[] for _ in verbalizer_configs]
         current_headers = []
         processed_nodes = set()
 
         elements = list(soup.descendants)
         total_elements = len(elements)
+        self.profiler.count("elements", total_elements)
 
-        self.contextualizer = Contextualizer(elements, self.verbalizer_config.context_mode)
+        contextualizers = {}
+        for verbalizer_config in verbalizer_configs:
+            mode_key = tuple(verbalizer_config.context_mode)
+            if mode_key not in contextualizers:
+                contextualizers[mode_key] = Contextualizer(elements, verbalizer_config.context_mode)
+        config_contextualizers = [contextualizers[tuple(config.context_mode)] for config in verbalizer_configs]
+        self.contextualizer = config_contextualizers[0]
 
         def is_inside_special_tag(el, tags=('table', 'ul', 'ol')):
             parent = getattr(el, 'parent', None)
@@ -52,6 +76,27 @@ class PassageExtractor:
                 parent = parent.parent
             return False
 
+        def append_shared_passage(passage: Passage, idx: int, is_list_or_table: bool):
+            # The first config owns the passage, the others get a copy with their own running passage id. The copies
+            # do not share any mutable fields, so later changes to one config's passages do not leak into the others.
+            with self.profiler.stage("context_collection"):
+                config_contextualizers[0].collect_contexts(passage, idx, current_headers, self.document.title,
+                                                           is_list_or_table=is_list_or_table)
+            passages_per_config[0].append(passage)
+            for contextualizer, passages in zip(config_contextualizers[1:], passages_per_config[1:]):
+                passage_copy = replace(
+                    passage,
+                    passage_id=f"{self.document.id}-{len(passages)}",
+                    headers=list(passage.headers),
+                    metadata=copy.deepcopy(passage.metadata),
+                    attachment=passage.attachment.model_copy(deep=True) if passage.attachment else None,
+                )
+                if contextualizer is not config_contextualizers[0]:
+                    with self.profiler.stage("context_collection"):
+                        contextualizer.collect_contexts(passage_copy, idx, current_headers, self.document.title,
+                                                        is_list_or_table=is_list_or_table)
+                passages.append(passage_copy)
+
         for idx, element in enumerate(elements):
             if element in processed_nodes:
                 continue
@@ -60,22 +105,28 @@ class PassageExtractor:
                 if element.name in header_tags:
                     # If we have accumulated content before this header, finalize that passage first
                     if self.content_processor.current_content:
-                        passage = self.content_processor.finalize_passage(current_headers, document_id=self.document.id, passage_count=len(passages))
+                        passage = self.content_processor.finalize_passage(current_headers, document_id=self.document.id, passage_count=len(passages_per_config[0]))
                         if passage:
-                            self.contextualizer.collect_contexts(passage, idx, current_headers, self.document.title,
-                                                                 is_list_or_table=False)
-                            passages.append(passage)
+                            append_shared_passage(passage, idx, is_list_or_table=False)
 
                     self.header_processor.process(element, current_headers)
 
                 elif element.name == 'table':
                     if "table" in self.allowed_modalities:
-                        table_passages = self.table_processor.process(element, current_headers, self.verbalizer_config,
-                                                                      document_id=self.document.id, passage_count=len(passages))
-                        for psg in table_passages:
-                            self.contextualizer.collect_contexts(psg, idx, current_headers, self.document.title,
-                                                                 is_list_or_table=True)
-                        passages.extend(table_passages)
+                        with self.profiler.stage("table_parsing"):
+                            grid = TableGrid(element)
+                        self.profiler.count("tables")
+                        self.profiler.count("table_rows", len(grid.rows))
+                        for verbalizer_config, table_processor, contextualizer, passages in zip(
+                                verbalizer_configs, table_processors, config_contextualizers, passages_per_config):
+                            with table_processor.profiler.stage("table_rendering"):
+                                table_passages = table_processor.process(element, current_headers, verbalizer_config,
+                                                                         document_id=self.document.id, passage_count=len(passages), grid=grid)
+                            with self.profiler.stage("context_collection"):
+                                for psg in table_passages:
+                                    contextualizer.collect_contexts(psg, idx, current_headers, self.document.title,
+                                                                    is_list_or_table=True)
+                            passages.extend(table_passages)
 
                     # Mark table and descendants as processed, regardless of inclusion
                     processed_nodes.add(element)
@@ -86,11 +137,11 @@ class PassageExtractor:
 
                 elif element.name in ['ul', 'ol']:
                     if "list" in self.allowed_modalities:
-                        list_passage = self.list_processor.process(element, current_headers,
-                                                                   document_id=self.document.id, passage_count=len(passages))
-                        self.contextualizer.collect_contexts(list_passage, idx, current_headers, self.document.title,
-                                                             is_list_or_table=True)
-                        passages.append(list_passage)
+                        with self.profiler.stage("list_processing"):
+                            list_passage = self.list_processor.process(element, current_headers,
+                                                                       document_id=self.document.id, passage_count=len(passages_per_config[0]))
+                        self.profiler.count("lists")
+                        append_shared_passage(list_passage, idx, is_list_or_table=True)
 
                     # Mark list and descendants as processed, regardless of inclusion
                     processed_nodes.add(element)
@@ -108,13 +159,14 @@ class PassageExtractor:
 
         # Finalize any remaining content after processing all elements
         if self.content_processor.current_content:
-            passage = self.content_processor.finalize_passage(current_headers, document_id=self.document.id, passage_count=len(passages))
+            passage = self.content_processor.finalize_passage(current_headers, document_id=self.document.id, passage_count=len(passages_per_config[0]))
             if passage:
-                self.contextualizer.collect_contexts(passage, total_elements - 1, current_headers, self.document.title,
-                                                     is_list_or_table=False)
-                passages.append(passage)
+                append_shared_passage(passage, total_elements - 1, is_list_or_table=False)
 
-        return passages
+        return [
+            self.content_processor.normalize_passages(passages, config.min_passage_tokens, config.max_passage_tokens)
+            for config, passages in zip(verbalizer_configs, passages_per_config)
+        ]
 
 
 def parse_html_content(html_content: str) -> BeautifulSoup:
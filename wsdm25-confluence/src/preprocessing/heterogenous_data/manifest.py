@@ -0,0 +1,141 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+from models.data import Document, TableAttachment
+from preprocessing.model import Passage
+from preprocessing.utils import recursive_to_dict
+
+# Bump whenever the extraction logic changes in a way that invalidates cached passages.
+MANIFEST_VERSION = 1
+
+
+def _sha256(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def hash_document(document: Document) -> str:
+    return _sha256(json.dumps(document.model_dump(exclude={"embedding"}), sort_keys=True, default=str))
+
+
+def hash_config(verbalizer_config, modalities: Optional[List], db_path: Optional[Path] = None,
+                boilerplate_fingerprint: Optional[str] = None) -> str:
+    config = {
+        "version": MANIFEST_VERSION,
+        "verbalizer_config": recursive_to_dict(verbalizer_config),
+        "modalities": recursive_to_dict(modalities),
+        # Skipped documents do not write their tables again, so the table store is part of the configuration.
+        "db_path": str(db_path) if db_path else None,
+    }
+    if boilerplate_fingerprint:
+        # The stripped lines depend on the whole corpus, so cached passages are only valid for the same lines.
+        config["boilerplate"] = boilerplate_fingerprint
+    return _sha256(json.dumps(config, sort_keys=True, default=str))
+
+
+def passage_to_dict(passage: Passage) -> Dict[str, Any]:
+    return recursive_to_dict(passage)
+
+
+def passage_from_dict(data: Dict[str, Any]) -> Passage:
+    attachment = data.get("attachment")
+    return Passage(**{**data, "attachment": TableAttachment(**attachment) if attachment else None})
+
+
+class PreprocessingManifest:
+    """
+    Keeps track of which documents have already been processed with which configuration.
+
+    The manifest in `out_dir` maps each document id to the hash of its content, the hash of the pipeline
+    configuration and the ids of the passages it produced. The extracted passages themselves are cached per document,
+    so unchanged documents can be skipped on the next run. The difference to the previous run is written as a delta
+    (added/removed passage ids) that downstream embedding and indexing can apply.
+    """
+    manifest_filename = "manifest.json"
+    delta_filename = "delta.json"
+    cache_dirname = "passage_cache"
+
+    def __init__(self, out_dir: Path, config_hash: str):
+        self.out_dir = out_dir
+        self.config_hash = config_hash
+        self.cache_dir = out_dir / self.cache_dirname
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.previous: Dict[str, Dict[str, Any]] = {}
+        manifest_path = out_dir / self.manifest_filename
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            if manifest.get("version") == MANIFEST_VERSION:
+                self.previous = manifest.get("documents", {})
+
+        self.current: Dict[str, Dict[str, Any]] = {}
+        self.changed_documents: List[str] = []
+
+    def _cache_path(self, document_id: str) -> Path:
+        return self.cache_dir / f"{_sha256(document_id)[:32]}.json"
+
+    def get_cached_passages(self, document: Document) -> Optional[List[Passage]]:
+        """ Returns the cached passages of a document, or None if it is new, changed or processed differently. """
+        content_hash = hash_document(document)
+        entry = self.previous.get(document.id)
+        cache_path = self._cache_path(document.id)
+
+        if entry is None or entry["content_hash"] != content_hash or entry["config_hash"] != self.config_hash \
+                or not cache_path.exists():
+            return None
+
+        passages = [passage_from_dict(p) for p in json.loads(cache_path.read_text(encoding="utf-8"))]
+        self.current[document.id] = entry
+        return passages
+
+    def store(self, document: Document, passages: List[Passage]):
+        cache_path = self._cache_path(document.id)
+        cache_path.write_text(json.dumps([passage_to_dict(p) for p in passages], ensure_ascii=False), encoding="utf-8")
+
+        self.current[document.id] = {
+            "content_hash": hash_document(document),
+            "config_hash": self.config_hash,
+            "passage_ids": [p.passage_id for p in passages],
+        }
+        self.changed_documents.append(document.id)
+
+    def compute_delta(self) -> Dict[str, Any]:
+        deleted_documents = [doc_id for doc_id in self.previous if doc_id not in self.current]
+
+        removed, added = [], []
+        for doc_id in self.changed_documents + deleted_documents:
+            if doc_id in self.previous:
+                removed.extend(self.previous[doc_id]["passage_ids"])
+        for doc_id in self.changed_documents:
+            added.extend(self.current[doc_id]["passage_ids"])
+
+        return {
+            "added": added,
+            "removed": removed,
+            "changed_documents": self.changed_documents,
+            "deleted_documents": deleted_documents,
+            "unchanged_documents": len(self.current) - len(self.changed_documents),
+        }
+
+    def save(self) -> Dict[str, Any]:
+        """ Writes the manifest and the delta to the last run, and drops cached passages of deleted documents. """
+        delta = self.compute_delta()
+
+        for doc_id in delta["deleted_documents"]:
+            self._cache_path(doc_id).unlink(missing_ok=True)
+
+        manifest = {"version": MANIFEST_VERSION, "documents": self.current}
+        (self.out_dir / self.manifest_filename).write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        (self.out_dir / self.delta_filename).write_text(json.dumps(delta, ensure_ascii=False, indent=4), encoding="utf-8")
+
+        print(f"Incremental preprocessing: {delta['unchanged_documents']} unchanged, "
+              f"{len(delta['changed_documents'])} new or changed, {len(delta['deleted_documents'])} deleted documents.")
+        return delta
+
+
+def load_delta(out_dir: Path) -> Optional[Dict[str, Any]]:
+    delta_path = out_dir / PreprocessingManifest.delta_filename
+    if not delta_path.exists():
+        return None
+    return json.loads(delta_path.read_text(encoding="utf-8"))
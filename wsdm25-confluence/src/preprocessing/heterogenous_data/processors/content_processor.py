@@ -1,6 +1,11 @@
-from typing import List, Dict, Any
+import re
+from dataclasses import replace
+from typing import List, Dict, Any, Optional
 
 from preprocessing.model import Passage
+from preprocessing.utils import estimate_tokens
+
+sentence_boundary = re.compile(r'(?<=[.!?])\s+')
 
 
 class ContentProcessor:
@@ -28,3 +33,90 @@ class ContentProcessor:
         self.clear_content()
 
         return passage
+
+    def normalize_passages(self, passages: List[Passage], min_tokens: Optional[int] = None, max_tokens: Optional[int] = None) -> List[Passage]:
+        """
+        Balances the size of text passages: passages above `max_tokens` are split on sentence boundaries, and adjacent
+        passages below `min_tokens` that share the same headers are merged (as long as the result stays within
+        `max_tokens`). Lists and tables are left untouched.
+        Passage ids stay stable: split parts get the part number appended (the first part keeps the original id),
+        merged passages keep the id of the first passage.
+        """
+        if min_tokens is None and max_tokens is None:
+            return passages
+
+        normalized = []
+        for passage in passages:
+            if not self._is_text_passage(passage):
+                normalized.append(passage)
+                continue
+
+            for part in self._split_passage(passage, max_tokens):
+                previous = normalized[-1] if normalized else None
+                if previous is not None and self._can_merge(previous, part, min_tokens, max_tokens):
+                    normalized[-1] = replace(previous, content=f"{previous.content} {part.content}", ctx_after=part.ctx_after)
+                else:
+                    normalized.append(part)
+
+        return normalized
+
+    @staticmethod
+    def _is_text_passage(passage: Passage) -> bool:
+        return not (passage.is_table or passage.is_table_row or passage.is_list)
+
+    def _can_merge(self, previous: Passage, passage: Passage, min_tokens: Optional[int], max_tokens: Optional[int]) -> bool:
+        if min_tokens is None or not self._is_text_passage(previous) or previous.headers != passage.headers:
+            return False
+        previous_tokens = estimate_tokens(previous.content)
+        tokens = estimate_tokens(passage.content)
+        if previous_tokens >= min_tokens and tokens >= min_tokens:
+            return False
+        return max_tokens is None or previous_tokens + tokens <= max_tokens
+
+    @staticmethod
+    def _split_passage(passage: Passage, max_tokens: Optional[int]) -> List[Passage]:
+        if max_tokens is None or estimate_tokens(passage.content) <= max_tokens:
+            return [passage]
+
+        # Sentences that exceed the budget on their own are split on whitespace
+        units = []
+        for sentence in sentence_boundary.split(passage.content):
+            if estimate_tokens(sentence) <= max_tokens:
+                units.append(sentence)
+                continue
+            chunk = []
+            for word in sentence.split():
+                if chunk and estimate_tokens(' '.join(chunk + [word])) > max_tokens:
+                    units.append(' '.join(chunk))
+                    chunk = []
+                chunk.append(word)
+            if chunk:
+                units.append(' '.join(chunk))
+
+        # Aim for parts of similar size instead of filling each part up and leaving a tiny remainder
+        num_parts = -(-estimate_tokens(passage.content) // max_tokens)
+        target_tokens = -(-estimate_tokens(passage.content) // num_parts)
+
+        parts = []
+        current = []
+        for unit in units:
+            if current and (estimate_tokens(' '.join(current)) >= target_tokens
+                            or estimate_tokens(' '.join(current + [unit])) > max_tokens):
+                parts.append(' '.join(current))
+                current = []
+            current.append(unit)
+        if current:
+            parts.append(' '.join(current))
+
+        # Like the contexts of the passages, the contexts of a part are its neighbors; only the first and last part
+        # keep the contexts of the whole passage
+        return [
+            replace(
+                passage,
+                content=part,
+                passage_id=passage.passage_id if idx == 0 else f"{passage.passage_id}-{idx}",
+                ctx_before=parts[idx - 1] if idx > 0 else passage.ctx_before,
+                ctx_after=parts[idx + 1] if idx < len(parts) - 1 else passage.ctx_after,
+            )
+            for idx, part in enumerate(parts)
+        ]
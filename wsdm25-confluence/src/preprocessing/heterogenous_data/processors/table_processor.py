@@ -1,43 +1,28 @@
-from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from bs4 import Tag
 
-from preprocessing.heterogenous_data.verbalization import verbalize_table, html_table_to_markdown, html_table_to_piped, table_to_json
+from preprocessing.heterogenous_data.verbalization import TableGrid
 from preprocessing.model import Passage, VerbalizerConfig
 from models.data import TableAttachment
-from preprocessing.utils import store_table, sanitize_passage_id
+from preprocessing.utils import TableStoreWriter, sanitize_passage_id, estimate_tokens
+from preprocessing.instrumentation import PipelineProfiler
 
 
 class TableProcessor:
     """
     Processes table elements, returning one or more Passages depending on granularity.
     """
-    def __init__(self, db_path: Optional[Path] = None):
-        self.db_path = db_path
+    def __init__(self, table_store: Optional[TableStoreWriter] = None, profiler: Optional[PipelineProfiler] = None):
+        self.table_store = table_store
+        self.profiler = profiler or PipelineProfiler()
 
-    def process(self, element: Tag, current_headers: List[Dict[str, Any]], verbalizer_config: VerbalizerConfig, document_id: str, passage_count: int) -> List[Passage]:
+    def process(self, element: Tag, current_headers: List[Dict[str, Any]], verbalizer_config: VerbalizerConfig, document_id: str, passage_count: int,
+                grid: Optional[TableGrid] = None) -> List[Passage]:
         mode = verbalizer_config.mode[0]
         granularity = verbalizer_config.granularity
 
-        if mode == 'verbalization':
-            table_lines = verbalize_table(element)
-            table_content = '\n'.join(line.strip() for line in table_lines)
-        elif mode == 'piped':
-            table_content, table_lines = html_table_to_piped(str(element), truncate_cells=False)
-        elif mode == 'markdown':
-            table_content, table_lines = html_table_to_markdown(str(element))
-        elif mode == 'html':
-            rows = element.find_all('tr')
-            table_lines = [str(row) for row in rows]
-            table_content = str(element)
-        elif mode == 'plaintext':
-            rows = element.find_all('tr')
-            table_lines = [row.get_text(separator=' ', strip=True) for row in rows]
-            table_content = element.get_text(separator=' ', strip=True)
-        else:
-            rows = element.find_all('tr')
-            table_lines = [row.get_text(separator=' ', strip=True) for row in rows]
-            table_content = element.get_text(separator=' ', strip=True)
+        grid = grid or TableGrid(element)
+        table_content, table_lines = grid.render(mode)
 
         passage_headers = [h['text'] for h in current_headers]
         table_passages = []
@@ -57,6 +42,24 @@ class TableProcessor:
 
                 table_passages.append(psg)
 
+        if "window" in granularity:
+            header_line_count = grid.header_line_count(mode, table_lines)
+            header_lines = [line.strip() for line in table_lines[:header_line_count]]
+            windows = self.split_into_windows(table_lines[header_line_count:], verbalizer_config.window_size,
+                                              verbalizer_config.window_token_budget)
+            for window_lines in windows:
+                # Row numbers refer to the table lines, like the row passages of the element granularity
+                first_row = header_line_count + window_lines[0][0]
+                last_row = header_line_count + window_lines[-1][0]
+                psg = Passage(
+                    headers=passage_headers,
+                    content='\n'.join(header_lines + [line.strip() for _, line in window_lines]),
+                    is_table_row=True,
+                    passage_id=passage_id + f"-{first_row}-{last_row}",
+                    attachment=TableAttachment(id=passage_id, row=first_row, row_range=(first_row, last_row)),
+                )
+                table_passages.append(psg)
+
         if any(g in ["entity", "all"] for g in granularity):
             psg = Passage(
                 headers=passage_headers,
@@ -68,12 +71,38 @@ class TableProcessor:
 
             table_passages.append(psg)
 
-        full_table, rows = html_table_to_piped(str(element))
-        if self.db_path:
-            store_table(self.db_path, passage_id, full_table, table_json=table_to_json(element))
+        if self.table_store:
+            full_table, _ = grid.to_piped()
+            table_json = grid.to_json()
+            with self.profiler.stage("sqlite_writes"):
+                self.table_store.add(passage_id, full_table, table_json=table_json)
 
         return table_passages
 
+    @staticmethod
+    def split_into_windows(lines: List[str], window_size: int, token_budget: Optional[int] = None) -> List[List[Tuple[int, str]]]:
+        """
+        Groups consecutive lines into windows of at most `window_size` lines. If a token budget is given, a window is
+        also closed once the next line would exceed it (a single line always makes up a window on its own).
+        Returns the windows as lists of (line index, line).
+        """
+        windows = []
+        current_window = []
+        current_tokens = 0
+        for line_idx, line in enumerate(lines):
+            line_tokens = estimate_tokens(line)
+            exceeds_budget = token_budget is not None and current_tokens + line_tokens > token_budget
+            if current_window and (len(current_window) >= window_size or exceeds_budget):
+                windows.append(current_window)
+                current_window = []
+                current_tokens = 0
+            current_window.append((line_idx, line))
+            current_tokens += line_tokens
+
+        if current_window:
+            windows.append(current_window)
+        return windows
+
     @staticmethod
     def create_attachment(passage_id: str, table_wise: bool) -> Optional[TableAttachment]:
         if not passage_id:
@@ -0,0 +1,179 @@
+import cProfile
+import io
+import json
+import pstats
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+
+class PipelineProfiler:
+    """
+    Records wall and CPU time per pipeline stage and per document, along with element counters.
+
+    Stages can be nested (e.g. `table_rendering` runs within `dom_walk`), so all stage times are inclusive.
+    If `profile_document_id` is set, the processing of that document is additionally captured with cProfile.
+
+    A `child` profiler records the stages and counters of one output collection of a grid. They are recorded per
+    document of the parent, and reported together with the parent's shared stages and counters (e.g. `html_parsing`).
+    """
+    def __init__(self, profile_document_id: Optional[str] = None, parent: Optional["PipelineProfiler"] = None):
+        self.profile_document_id = profile_document_id
+        self.parent = parent
+        self.stages = defaultdict(lambda: {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        self.counters = defaultdict(int)
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.profile: Optional[cProfile.Profile] = None
+        self._current_document: Optional[Dict[str, Any]] = None
+        self._current_document_id: Optional[str] = None
+
+    def child(self) -> "PipelineProfiler":
+        return PipelineProfiler(parent=self)
+
+    @staticmethod
+    def _new_document_record() -> Dict[str, Any]:
+        return {"wall": 0.0, "cpu": 0.0, "stages": defaultdict(float), "counters": defaultdict(int)}
+
+    def _document_record(self) -> Optional[Dict[str, Any]]:
+        if self.parent is None:
+            return self._current_document
+        document_id = self.parent._current_document_id
+        if document_id is None:
+            return None
+        if document_id not in self.documents:
+            self.documents[document_id] = self._new_document_record()
+        return self.documents[document_id]
+
+    @contextmanager
+    def stage(self, name: str):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            stage = self.stages[name]
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["calls"] += 1
+            record = self._document_record()
+            if record is not None:
+                record["stages"][name] += wall
+
+    @contextmanager
+    def document(self, document_id: str):
+        record = self._new_document_record()
+        self.documents[document_id] = record
+        self._current_document = record
+        self._current_document_id = document_id
+
+        profile = cProfile.Profile() if document_id == self.profile_document_id else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                self.profile = profile
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            self._current_document = None
+            self._current_document_id = None
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] += value
+        record = self._document_record()
+        if record is not None:
+            record["counters"][name] += value
+
+    def _merged(self) -> "PipelineProfiler":
+        """ For a child, a profiler holding the parent's records with the child's stages and counters added. """
+        if self.parent is None:
+            return self
+        merged = PipelineProfiler(self.parent.profile_document_id)
+        merged.profile = self.parent.profile
+        for source in (self.parent, self):
+            for name, stage in source.stages.items():
+                for key, value in stage.items():
+                    merged.stages[name][key] += value
+            for name, value in source.counters.items():
+                merged.counters[name] += value
+        for document_id, parent_record in self.parent.documents.items():
+            record = merged.documents[document_id] = self._new_document_record()
+            record["wall"], record["cpu"] = parent_record["wall"], parent_record["cpu"]
+            for source_record in (parent_record, self.documents.get(document_id)):
+                if source_record is None:
+                    continue
+                for name, wall in source_record["stages"].items():
+                    record["stages"][name] += wall
+                for name, value in source_record["counters"].items():
+                    record["counters"][name] += value
+        return merged
+
+    def slowest_documents(self, top_n: int = 10) -> List[str]:
+        return sorted(self.documents, key=lambda doc_id: self.documents[doc_id]["wall"], reverse=True)[:top_n]
+
+    def to_dict(self, top_n: int = 10) -> Dict[str, Any]:
+        if self.parent is not None:
+            return self._merged().to_dict(top_n)
+        total_wall = self.stages["total"]["wall"] if "total" in self.stages else sum(d["wall"] for d in self.documents.values())
+        return {
+            "total_wall": total_wall,
+            "documents_per_second": len(self.documents) / total_wall if total_wall else None,
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "slowest_documents": self.slowest_documents(top_n),
+            "documents": {
+                doc_id: {**record, "stages": dict(record["stages"]), "counters": dict(record["counters"])}
+                for doc_id, record in self.documents.items()
+            },
+        }
+
+    def summary_text(self, top_n: int = 10) -> str:
+        if self.parent is not None:
+            return self._merged().summary_text(top_n)
+        timings = self.to_dict(top_n)
+        summary_lines = [
+            10 * "=" + " TIMING " + 10 * "=",
+            f"Documents: {len(self.documents)}",
+            f"Total Wall Time: {timings['total_wall']:.3f}s",
+        ]
+        if timings["documents_per_second"]:
+            summary_lines.append(f"Documents per Second: {timings['documents_per_second']:.1f}")
+
+        summary_lines.append("Stages (inclusive, wall / cpu / calls):")
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]["wall"], reverse=True):
+            summary_lines.append(f"  {name}: {stage['wall']:.3f}s / {stage['cpu']:.3f}s / {stage['calls']}")
+
+        summary_lines.append("Counters:")
+        summary_lines.extend([f"  {name}: {value}" for name, value in sorted(self.counters.items())])
+
+        summary_lines.append(f"Slowest Documents (top {top_n}):")
+        for doc_id in timings["slowest_documents"]:
+            record = self.documents[doc_id]
+            counters = ", ".join(f"{name}: {value}" for name, value in sorted(record["counters"].items()))
+            summary_lines.append(f"  {doc_id}: {record['wall']:.3f}s ({counters})")
+
+        summary_lines.append(10 * "=" + " END TIMING " + 10 * "=" + "\n")
+        return "\n".join(summary_lines)
+
+    def save(self, out_dir: Path, top_n: int = 10):
+        """ Writes `timings.json` and, if a document has been profiled, its cProfile stats to `out_dir`. """
+        if self.parent is not None:
+            return self._merged().save(out_dir, top_n)
+        timings_path = out_dir / "timings.json"
+        timings_path.write_text(json.dumps(self.to_dict(top_n), indent=4), encoding="utf-8")
+        print(f"Timings saved to: {timings_path.resolve()}")
+
+        if self.profile:
+            profile_name = "profile_" + re.sub(r"[^\w.-]", "_", self.profile_document_id)
+            self.profile.dump_stats(str(out_dir / f"{profile_name}.prof"))
+
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(30)
+            (out_dir / f"{profile_name}.txt").write_text(stream.getvalue(), encoding="utf-8")
+            print(f"Profile of document {self.profile_document_id} saved to: {(out_dir / profile_name).resolve()}.prof")
@@ -0,0 +1,84 @@
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from models.data import Document
+
+
+class KnnGraph:
+    """
+    Sparse k-nearest-neighbour graph over the passage embeddings: for every passage, the ids of its `num_neighbours`
+    most similar passages and their cosine similarities.
+
+    The graph is built offline in `prepare` with blocked matrix products, so the full similarity matrix is never held
+    in memory. At query time, the similarities between retrieved evidences can be looked up instead of being computed.
+    """
+    filename = "knn_graph.npz"
+
+    def __init__(self, ids: List[str], neighbours: np.ndarray, similarities: np.ndarray):
+        self.ids = list(ids)
+        self.neighbours = neighbours
+        self.similarities = similarities
+        self.positions = {doc_id: position for position, doc_id in enumerate(self.ids)}
+
+    @classmethod
+    def build(cls, documents: List[Document], num_neighbours: int = 32, block_size: int = 1024) -> "KnnGraph":
+        documents = [doc for doc in documents if doc.embedding is not None]
+        embeddings = np.array([doc.embedding for doc in documents], dtype=np.float32)
+        if len(embeddings):
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+        num_neighbours = max(0, min(num_neighbours, len(documents) - 1))
+        neighbours = np.zeros((len(documents), num_neighbours), dtype=np.int32)
+        similarities = np.zeros((len(documents), num_neighbours), dtype=np.float32)
+
+        for start in range(0, len(documents) if num_neighbours else 0, block_size):
+            end = min(start + block_size, len(documents))
+            block = embeddings[start:end] @ embeddings.T
+            block[np.arange(end - start), np.arange(start, end)] = -np.inf  # a passage is not its own neighbour
+
+            top = np.argpartition(-block, num_neighbours - 1, axis=1)[:, :num_neighbours]
+            top_similarities = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_similarities, axis=1)
+            neighbours[start:end] = np.take_along_axis(top, order, axis=1)
+            similarities[start:end] = np.take_along_axis(top_similarities, order, axis=1)
+
+        return cls([doc.id for doc in documents], neighbours, similarities)
+
+    def save(self, out_dir: Path):
+        graph_path = out_dir / self.filename
+        np.savez(graph_path, ids=np.array(self.ids), neighbours=self.neighbours, similarities=self.similarities)
+        print(f"kNN graph of {len(self.ids)} passages saved to: {graph_path.resolve()}")
+
+    @classmethod
+    def load(cls, out_dir: Path) -> Optional["KnnGraph"]:
+        graph_path = out_dir / cls.filename
+        if not graph_path.exists():
+            return None
+        data = np.load(graph_path)
+        return cls(data["ids"].tolist(), data["neighbours"], data["similarities"])
+
+    def similarity_matrix(self, doc_ids: List[str], min_similarity: float) -> Optional[np.ndarray]:
+        """
+        Looks up the pairwise similarities of the given passages. Pairs that are not neighbours in the graph are set
+        to -1; this is exact for thresholding at `min_similarity` as long as their similarity cannot reach it, i.e. if
+        the last neighbour of either passage is below `min_similarity`.
+        Returns None if a passage is not in the graph or the graph is too sparse to decide.
+        """
+        positions = [self.positions.get(doc_id) for doc_id in doc_ids]
+        if any(position is None for position in positions):
+            return None
+
+        positions = np.array(positions)
+        # is_neighbour[i, j, n]: the n-th neighbour of passage i is passage j
+        is_neighbour = self.neighbours[positions][:, None, :] == positions[None, :, None]
+        matrix = np.where(is_neighbour, self.similarities[positions][:, None, :], -1.0).max(axis=2, initial=-1.0)
+        matrix = np.maximum(matrix, matrix.T)
+        matrix[positions[:, None] == positions[None, :]] = 1.0
+
+        # Upper bound of the similarity of pairs missing from the graph: the similarity of the last neighbour
+        last_similarity = self.similarities[positions, -1] if self.similarities.shape[1] else np.full(len(positions), -1.0)
+        upper_bound = np.minimum(last_similarity[:, None], last_similarity[None, :])
+        if np.any((matrix == -1.0) & (upper_bound >= min_similarity)):
+            return None
+        return matrix
@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Literal, Optional, List, Union
+from typing import Literal, Optional, List, Union, Dict, Any
 from dataclasses import dataclass, field
 from models.data import Document, Attachment
 
@@ -12,12 +12,26 @@ class VerbalizerConfig:
     # Element could be a table-row, or a single property in a graph-db
     # Entity could be a complete table, or an entire entity in a graph-db
     # "All" will create multiple variants and store them in parallel.
-    granularity: List[Literal["element", "entity", "all"]] = field(default_factory=lambda: ["element"])
+    # Window groups `window_size` consecutive elements into one package, e.g. table-rows with the table header repeated.
+    granularity: List[Literal["element", "entity", "window", "all"]] = field(default_factory=lambda: ["element"])
+    window_size: int = 10
+    # Optional approximate token budget per window; a window is closed early once the next element would exceed it.
+    window_token_budget: Optional[int] = None
 
     # Whether to keep the original content after verbalization and store it alongside the verbalizations.
     embed_original_content: bool = False
     context_mode: List[Literal["all", "none", "entity_title", "preceding_heading", "page_title", "ctx_before", "ctx_after"]] = field(default_factory=lambda: ["all"])
 
+    # Optional approximate token range for text passages: smaller adjacent passages under the same headers are merged,
+    # larger ones are split on sentence boundaries. Lists and tables are not affected.
+    min_passage_tokens: Optional[int] = None
+    max_passage_tokens: Optional[int] = None
+
+    # Optional share of documents a line (of at least three words) has to occur in to be stripped as boilerplate,
+    # e.g. "Owned by ..." and "Last updated: ..." headers; lines that only differ in names, dates or numbers count as
+    # the same line. Tables are not affected.
+    boilerplate_min_document_ratio: Optional[float] = None
+
 
 @dataclass
 class MultiModalConfig:
@@ -53,4 +67,5 @@ class Passage:
     is_table_row: bool = False
     is_list: bool = False
 
-    attachment: Optional[Attachment] = None
\ No newline at end of file
+    attachment: Optional[Attachment] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)
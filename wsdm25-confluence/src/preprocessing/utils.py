@@ -1,9 +1,8 @@
 import json
 import os
 import sqlite3
-from collections import defaultdict
+from collections import Counter, defaultdict
 from pathlib import Path
-from statistics import median
 from typing import Optional, Dict, Any, List
 from preprocessing.model import Passage
 
@@ -34,6 +33,11 @@ def save_config_as_json(db_filepath: Path, config: dict):
     print(f"Configuration saved to {json_filepath}")
 
 
+def estimate_tokens(text: str) -> int:
+    """ Approx. 4 chars per token. Please note this is a very rough estimation to avoid bloating this up. """
+    return len(text) // 4
+
+
 def truncate(text, max_length=10, buffer=5):
     """ Truncates text to a maximum length, extending to complete the current word if it goes slightly over. """
     if len(text) <= max_length:
@@ -46,127 +50,195 @@ def truncate(text, max_length=10, buffer=5):
     return text[:end] + "..."
 
 
-def store_table(db_path: Path, table_id: str, table_html, table_json: Optional[Dict[str, Any]] = None):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-
-    c.execute('''CREATE TABLE IF NOT EXISTS tables
-                 (table_id TEXT PRIMARY KEY, table_html TEXT, table_json TEXT)''')
-
-    # Overwrite existing table if exists
-    c.execute('SELECT COUNT(*) FROM tables WHERE table_id = ?', (table_id,))
-    if c.fetchone()[0] > 0:
-        c.execute('DELETE FROM tables WHERE table_id = ?', (table_id,))
-
-    json_data = json.dumps(table_json) if table_json else None
-    c.execute('INSERT INTO tables (table_id, table_html, table_json) VALUES (?, ?, ?)', (table_id, table_html, json_data))
-
-    conn.commit()
-    conn.close()
-
-
-def generate_heterogenous_processing_summary_from_passages(passages: List[Passage], document_count: Optional[int] = None) -> str:
-    spaces = set()
-    unique_pages = set()
-    pages_per_origin = defaultdict(int)
-    tables_per_origin = defaultdict(int)
+class TableStoreWriter:
+    """
+    Writes tables to the SQLite table store over a single connection.
+
+    Rows are buffered and upserted with `executemany`. They are committed on `flush`, which the pipeline calls
+    once per document, or as soon as `batch_size` rows are pending. The database runs in WAL mode, so a commit
+    does not rewrite the main database file.
+    """
+    def __init__(self, db_path: Path, batch_size: int = 256):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._pending = []
+
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tables
+                     (table_id TEXT PRIMARY KEY, table_html TEXT, table_json TEXT)''')
+        self.conn.commit()
+
+    def add(self, table_id: str, table_html, table_json: Optional[Dict[str, Any]] = None):
+        json_data = json.dumps(table_json) if table_json else None
+        self._pending.append((table_id, table_html, json_data))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        # Overwrite existing table if exists
+        self.conn.executemany(
+            '''INSERT INTO tables (table_id, table_html, table_json) VALUES (?, ?, ?)
+               ON CONFLICT(table_id) DO UPDATE SET table_html = excluded.table_html, table_json = excluded.table_json''',
+            self._pending,
+        )
+        self.conn.commit()
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-    total_tables = 0
-    total_words = 0
-    total_lists = 0
-    pages_with_tables = set()
-    pages_with_lists = set()
-    pages_with_passages = set()
-    pages_with_passage_list_table = set()
 
-    table_text_lengths = []
-    passage_word_lengths = []
-    list_word_lengths = []
-
-    unique_tables = set()  # To track distinct tables by `document_id` and `passage_count`
-    unique_lists = set()  # To track distinct lists by `document_id` and `passage_count`
-
-    page_feature_tracker = defaultdict(lambda: {"has_table": False, "has_list": False, "has_passage": False})
-
-    for passage in passages:
+def store_table(db_path: Path, table_id: str, table_html, table_json: Optional[Dict[str, Any]] = None):
+    """ Stores a single table. Prefer a shared `TableStoreWriter` when storing many tables. """
+    with TableStoreWriter(db_path) as writer:
+        writer.add(table_id, table_html, table_json)
+
+
+def _counter_median(counts: Counter) -> float:
+    """ Median of the values counted in `counts`, same as `statistics.median` of the expanded values. """
+    total = sum(counts.values())
+    if not total:
+        return 0
+    lower, upper = (total - 1) // 2, total // 2
+    lower_value = upper_value = None
+    seen = 0
+    for value in sorted(counts):
+        seen += counts[value]
+        if lower_value is None and seen > lower:
+            lower_value = value
+        if seen > upper:
+            upper_value = value
+            break
+    return lower_value if lower == upper else (lower_value + upper_value) / 2
+
+
+class ProcessingSummary:
+    """
+    Running statistics of the processed passages, updated passage by passage so the passages do not have to be kept.
+    """
+    def __init__(self):
+        self.spaces = set()
+        self.unique_pages = set()
+        self.pages_per_origin = defaultdict(int)
+        self.tables_per_origin = defaultdict(int)
+
+        self.total_passages = 0
+        self.total_tables = 0
+        self.total_words = 0
+        self.total_lists = 0
+        self.pages_with_tables = set()
+        self.pages_with_lists = set()
+        self.pages_with_passages = set()
+
+        # Word lengths are counted per length, which is enough for the medians
+        self.table_text_lengths = Counter()
+        self.passage_word_lengths = Counter()
+        self.list_word_lengths = Counter()
+
+        self.unique_tables = set()  # To track distinct tables by `document_id` and `passage_count`
+        self.unique_lists = set()  # To track distinct lists by `document_id` and `passage_count`
+
+        self.page_feature_tracker = defaultdict(lambda: {"has_table": False, "has_list": False, "has_passage": False})
+
+    def add(self, passage: Passage):
+        self.total_passages += 1
         space = passage.space
-        spaces.add(space)
+        self.spaces.add(space)
 
         page_title = passage.page_title
-        unique_pages.add(page_title)
-        pages_per_origin[space] += 1
+        self.unique_pages.add(page_title)
+        self.pages_per_origin[space] += 1
 
         # Count words in passage content
         words_in_passage = len(passage.content.split())
-        total_words += words_in_passage
-        passage_word_lengths.append(words_in_passage)
+        self.total_words += words_in_passage
+        self.passage_word_lengths[words_in_passage] += 1
 
         if passage.is_table:
             unique_table_id = f"{passage.passage_id}"  # `document_id-passage_count` for unique tables
-            if unique_table_id not in unique_tables:
-                unique_tables.add(unique_table_id)
-                total_tables += 1
-                pages_with_tables.add(page_title)
-                table_text_lengths.append(words_in_passage)
-                page_feature_tracker[page_title]["has_table"] = True
+            if unique_table_id not in self.unique_tables:
+                self.unique_tables.add(unique_table_id)
+                self.total_tables += 1
+                self.pages_with_tables.add(page_title)
+                self.table_text_lengths[words_in_passage] += 1
+                self.page_feature_tracker[page_title]["has_table"] = True
 
         if passage.is_list:
             unique_list_id = f"{passage.passage_id}"  # `document_id-passage_count` for unique lists
-            if unique_list_id not in unique_lists:
-                unique_lists.add(unique_list_id)
-                total_lists += 1
-                pages_with_lists.add(page_title)
-                list_word_lengths.append(words_in_passage)
-                page_feature_tracker[page_title]["has_list"] = True
-
-        if not passage.is_table and not passage.is_list and passage.content.strip() and not page_feature_tracker[page_title]["has_passage"]:
-            pages_with_passages.add(page_title)
-            page_feature_tracker[page_title]["has_passage"] = True
-
-    for page_title, features in page_feature_tracker.items():
-        if features["has_table"] and features["has_list"] and features["has_passage"]:
-            pages_with_passage_list_table.add(page_title)
-
-    total_passages = len(passages)
-    only_passages = total_passages - total_lists - total_tables
-
-    median_table_text_lengths = median(table_text_lengths) if table_text_lengths else 0
-    median_passage_word_length = median(passage_word_lengths) if passage_word_lengths else 0
-    median_list_word_length = median(list_word_lengths) if list_word_lengths else 0
-
-    summary_lines = [
-        10 * "=" + " SUMMARY " + 10 * "=",
-        f"Processed Pages in Total: {len(unique_pages)}",
-        f"Unique Origins: {', '.join(spaces)}",
-        "Pages Processed Per Origin:"
-    ]
-    summary_lines.extend([f"  {origin}: {count}" for origin, count in pages_per_origin.items()])
-    summary_lines.append("Tables in Each Origin:")
-    summary_lines.extend([f"  {origin}: {count}" for origin, count in tables_per_origin.items()])
-
-    summary_lines.extend([
-        f"Total Number of Tables Across All Data: {total_tables}",
-        f"Number of Pages with Tables: {len(pages_with_tables)}",
-        f"Total Number of Lists: {total_lists}",
-        f"Number of Pages with Lists: {len(pages_with_lists)}",
-        f"Number of Pages with Passages: {len(pages_with_passages)}",
-        f"Number of Pages with Passages + Lists + Tables: {len(pages_with_passage_list_table)}",
-        f"Total Number of Passages (including tables, lists): {total_passages}",
-        f"Number of pure Passages: {only_passages}",
-        f"Total Number of Words: {total_words}",
-        f"Median Word Length per Passage: {median_passage_word_length}",
-        f"Median Table Text Length (words): {median_table_text_lengths}",
-        f"Median List Size (words): {median_list_word_length}",
-        f"Num Pages with Text+Lists: {len(pages_with_lists)}",
-        f"Num Pages with Text+Tables: {len(pages_with_tables)}",
-        f"Num Pages with Tables+Lists: {len(pages_with_passage_list_table)}",
-        10 * "=" + " END SUMMARY " + 10 * "=" + "\n",
-        f"Total number of resulting documents due to mode (should match total number of passages): {document_count}" if document_count else "",
-    ])
-
-    summary_text = "\n".join(summary_lines)
-    print(summary_text)
-    return summary_text
+            if unique_list_id not in self.unique_lists:
+                self.unique_lists.add(unique_list_id)
+                self.total_lists += 1
+                self.pages_with_lists.add(page_title)
+                self.list_word_lengths[words_in_passage] += 1
+                self.page_feature_tracker[page_title]["has_list"] = True
+
+        if not passage.is_table and not passage.is_list and passage.content.strip() and not self.page_feature_tracker[page_title]["has_passage"]:
+            self.pages_with_passages.add(page_title)
+            self.page_feature_tracker[page_title]["has_passage"] = True
+
+    def text(self, document_count: Optional[int] = None) -> str:
+        pages_with_passage_list_table = set()
+        for page_title, features in self.page_feature_tracker.items():
+            if features["has_table"] and features["has_list"] and features["has_passage"]:
+                pages_with_passage_list_table.add(page_title)
+
+        only_passages = self.total_passages - self.total_lists - self.total_tables
+
+        median_table_text_lengths = _counter_median(self.table_text_lengths)
+        median_passage_word_length = _counter_median(self.passage_word_lengths)
+        median_list_word_length = _counter_median(self.list_word_lengths)
+
+        summary_lines = [
+            10 * "=" + " SUMMARY " + 10 * "=",
+            f"Processed Pages in Total: {len(self.unique_pages)}",
+            f"Unique Origins: {', '.join(self.spaces)}",
+            "Pages Processed Per Origin:"
+        ]
+        summary_lines.extend([f"  {origin}: {count}" for origin, count in self.pages_per_origin.items()])
+        summary_lines.append("Tables in Each Origin:")
+        summary_lines.extend([f"  {origin}: {count}" for origin, count in self.tables_per_origin.items()])
+
+        summary_lines.extend([
+            f"Total Number of Tables Across All Data: {self.total_tables}",
+            f"Number of Pages with Tables: {len(self.pages_with_tables)}",
+            f"Total Number of Lists: {self.total_lists}",
+            f"Number of Pages with Lists: {len(self.pages_with_lists)}",
+            f"Number of Pages with Passages: {len(self.pages_with_passages)}",
+            f"Number of Pages with Passages + Lists + Tables: {len(pages_with_passage_list_table)}",
+            f"Total Number of Passages (including tables, lists): {self.total_passages}",
+            f"Number of pure Passages: {only_passages}",
+            f"Total Number of Words: {self.total_words}",
+            f"Median Word Length per Passage: {median_passage_word_length}",
+            f"Median Table Text Length (words): {median_table_text_lengths}",
+            f"Median List Size (words): {median_list_word_length}",
+            f"Num Pages with Text+Lists: {len(self.pages_with_lists)}",
+            f"Num Pages with Text+Tables: {len(self.pages_with_tables)}",
+            f"Num Pages with Tables+Lists: {len(pages_with_passage_list_table)}",
+            10 * "=" + " END SUMMARY " + 10 * "=" + "\n",
+            f"Total number of resulting documents due to mode (should match total number of passages): {document_count}" if document_count else "",
+        ])
+
+        summary_text = "\n".join(summary_lines)
+        print(summary_text)
+        return summary_text
+
+
+def generate_heterogenous_processing_summary_from_passages(passages: List[Passage], document_count: Optional[int] = None) -> str:
+    summary = ProcessingSummary()
+    for passage in passages:
+        summary.add(passage)
+    return summary.text(document_count)
 
 
 def sanitize_passage_id(passage_id):
@@ -1,17 +1,141 @@
-from typing import List
+import asyncio
+from concurrent.futures import Executor, Future
+from typing import Iterator, List, Optional
 
 import numpy as np
 from attribution import Attribution, AttributionOutput
-from preprocessing.embedding import Document, embed_text, vector_search
-from pydantic import BaseModel
-from utils import chat_with_gpt
+from completion_cache import CompletionCache
+from openai import AsyncOpenAI
+from preprocessing.embedding import Document, async_embed_text, cosine_similarities, embed_text
+from pydantic import BaseModel, ConfigDict, Field
+from utils import async_chat_with_gpt, chat_with_gpt, pack_evidences, stream_chat_with_gpt
 
 
 class RagResponse(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     query: str
     answer: str
     retrieved_docs: List[Document]
     attribution: List[str]
+    # Estimated tokens of the evidences in the prompt, if they were packed into a budget
+    context_tokens: Optional[int] = None
+    # Set if the attribution runs in the background, see `rag`
+    attribution_future: Optional[Future] = Field(default=None, exclude=True)
+
+    def wait_for_attribution(self) -> List[str]:
+        """ Blocks until a background attribution has finished and returns it. """
+        if self.attribution_future is not None:
+            self.attribution = self.attribution_future.result()
+            self.attribution_future = None
+        return self.attribution
+
+
+class StreamingRagResponse:
+    """
+    The answer of `rag_stream`: iterating over it yields the answer text while it is generated.
+    Once the answer is complete, it is collected in `answer` and attributed (in the background if an executor is given).
+    An interrupted iteration is resumed by iterating again, which only yields the rest of the answer; the answer is
+    attributed exactly once.
+    """
+    def __init__(
+        self,
+        query: str,
+        retrieved_docs: List[Document],
+        answer_stream: Iterator[str],
+        attributer: Attribution,
+        executor: Optional[Executor] = None,
+        context_tokens: Optional[int] = None,
+    ):
+        self.query = query
+        self.retrieved_docs = retrieved_docs
+        self.context_tokens = context_tokens
+        self.answer_stream = answer_stream
+        self.attributer = attributer
+        self.executor = executor
+        self.answer: Optional[str] = None
+        self.attribution_future: Optional[Future] = None
+        self._answer_parts: List[str] = []
+        self._done = False
+
+    def __iter__(self) -> Iterator[str]:
+        if self._done:
+            return
+        for text in self.answer_stream:
+            self._answer_parts.append(text)
+            yield text
+        if self._done:
+            # Completed by another iteration in the meantime
+            return
+        self._done = True
+        self.answer = "".join(self._answer_parts)
+
+        if self.executor is not None:
+            self.attribution_future = self.executor.submit(
+                attribute, self.attributer, self.query, self.retrieved_docs, self.answer
+            )
+        else:
+            self.attribution_future = Future()
+            self.attribution_future.set_result(
+                attribute(self.attributer, self.query, self.retrieved_docs, self.answer)
+            )
+
+    def to_response(self) -> RagResponse:
+        """ Consumes the rest of the answer and returns the complete response. """
+        for _ in self:
+            pass
+        return RagResponse(
+            query=self.query,
+            answer=self.answer,
+            retrieved_docs=self.retrieved_docs,
+            attribution=[],
+            attribution_future=self.attribution_future,
+            context_tokens=self.context_tokens,
+        )
+
+
+def _embedding_matrix(documents: List[Document]) -> np.ndarray:
+    return np.array(
+        [doc.embedding for doc in documents if doc.embedding is not None]
+    )
+
+
+def _top_documents(documents: List[Document], similarities: np.ndarray, top_k: int) -> List[Document]:
+    """ Returns copies of the `top_k` most similar documents, with their similarity as score. """
+    top_indices = np.argsort(-similarities)[:top_k]
+    return [documents[i].model_copy(update={"score": float(similarities[i])}) for i in top_indices]
+
+
+def _pack(top_docs: List[Document], context_token_budget: Optional[int], max_doc_tokens: Optional[int]):
+    if context_token_budget is None and max_doc_tokens is None:
+        return top_docs, None
+    packed = pack_evidences(top_docs, context_token_budget, max_doc_tokens=max_doc_tokens)
+    return packed.documents, packed.num_tokens
+
+
+def retrieve(query: str, documents: List[Document], top_k: int = 5) -> List[Document]:
+    embeddings = _embedding_matrix(documents)
+
+    query_vector = embed_text(query)
+    return _top_documents(documents, cosine_similarities(query_vector, embeddings), top_k)
+
+
+async def aretrieve(
+    query: str, documents: List[Document], top_k: int = 5, client: Optional[AsyncOpenAI] = None
+) -> List[Document]:
+    """ Same as `retrieve`, but awaitable; the query is embedded while the embedding matrix is stacked. """
+    query_vector, embeddings = await asyncio.gather(
+        async_embed_text(query, client=client),
+        asyncio.to_thread(_embedding_matrix, documents),
+    )
+    return _top_documents(documents, cosine_similarities(query_vector, embeddings), top_k)
+
+
+def attribute(attributer: Attribution, query: str, top_docs: List[Document], answer: str) -> List[str]:
+    softmax_output, attribution_result, doc_mappings = attributer.get_attributions(
+        query, top_docs, history=[], answer=answer
+    )  # TODO: add history when available
+    return softmax_output
 
 
 def rag(
@@ -20,30 +144,103 @@ def rag(
     documents: List[Document],
     top_k: int = 5,
     completion_model: str = "gpt-4o",
+    executor: Optional[Executor] = None,
+    context_token_budget: Optional[int] = None,
+    max_doc_tokens: Optional[int] = None,
+    completion_cache: Optional[CompletionCache] = None,
 ) -> RagResponse:
+    """
+    Retrieves the `top_k` documents for the query, answers it and attributes the answer to the retrieved documents.
+    If an `executor` is given, the attribution is submitted to it and the response is returned right after the answer
+    has been generated; its `attribution` is empty until `attribution_future` (or `wait_for_attribution`) resolves.
+    With a `context_token_budget` or `max_doc_tokens`, the retrieved documents are packed into the budget and cut to
+    the per-document limit (see `utils.pack_evidences`); both the answer and its attribution use the packed documents,
+    which are returned as `retrieved_docs`.
+    With a `completion_cache`, the answer is taken from it if the same prompt was answered before.
+    """
+    top_docs, context_tokens = _pack(retrieve(query, documents, top_k), context_token_budget, max_doc_tokens)
 
-    embeddings = np.array(
-        [doc.embedding for doc in documents if doc.embedding is not None]
+    answer = chat_with_gpt(query, top_docs, completion_model, cache=completion_cache)
+
+    if executor is not None:
+        return RagResponse(
+            query=query,
+            answer=answer.content,
+            retrieved_docs=top_docs,
+            attribution=[],
+            attribution_future=executor.submit(attribute, attributer, query, top_docs, answer.content),
+            context_tokens=context_tokens,
+        )
+
+    return RagResponse(
+        query=query,
+        answer=answer.content,
+        retrieved_docs=top_docs,
+        attribution=attribute(attributer, query, top_docs, answer.content),
+        context_tokens=context_tokens,
     )
 
-    query_vector = embed_text(query)
-    top_indices = vector_search(query_vector, embeddings, top_k=top_k)
-    top_docs = [documents[i] for i in top_indices]
 
-    answer = chat_with_gpt(query, top_docs, completion_model)
+async def arag(
+    query: str,
+    attributer: Attribution,
+    documents: List[Document],
+    top_k: int = 5,
+    completion_model: str = "gpt-4o",
+    client: Optional[AsyncOpenAI] = None,
+    context_token_budget: Optional[int] = None,
+    max_doc_tokens: Optional[int] = None,
+    completion_cache: Optional[CompletionCache] = None,
+) -> RagResponse:
+    """
+    Same as `rag`, but awaitable. All requests (query embedding, answer, counterfactual answers and their embeddings)
+    are sent with one `client`, whose connections are kept alive and reused across queries. By default, this is the
+    client of the attributer for the running event loop (see `Attribution.async_client`).
+    The evidences are clustered for the attribution while the answer is generated.
+    """
+    client = client or attributer.async_client()
+
+    top_docs, context_tokens = _pack(
+        await aretrieve(query, documents, top_k, client), context_token_budget, max_doc_tokens
+    )
 
-    softmax_output, attribution_result, doc_mappings = attributer.get_attributions(
-        query, top_docs, history=[], answer=answer.content
-    )  # TODO: add history when available
+    answer, clusters = await asyncio.gather(
+        async_chat_with_gpt(query, top_docs, completion_model, client=client, cache=completion_cache),
+        attributer.cluster_evidences(top_docs, client=client),
+    )
 
+    softmax_output, attribution_result, doc_mappings = await attributer.aget_attributions(
+        query, top_docs, history=[], answer=answer.content, clusters=clusters, client=client
+    )  # TODO: add history when available
     return RagResponse(
         query=query,
         answer=answer.content,
         retrieved_docs=top_docs,
         attribution=softmax_output,
+        context_tokens=context_tokens,
     )
 
 
+def rag_stream(
+    query: str,
+    attributer: Attribution,
+    documents: List[Document],
+    top_k: int = 5,
+    completion_model: str = "gpt-4o",
+    executor: Optional[Executor] = None,
+    context_token_budget: Optional[int] = None,
+    max_doc_tokens: Optional[int] = None,
+    completion_cache: Optional[CompletionCache] = None,
+) -> StreamingRagResponse:
+    """
+    Same as `rag`, but returns as soon as the documents are retrieved. The answer is streamed while iterating over
+    the response, and attributed once it is complete. A cached answer is streamed in one piece.
+    """
+    top_docs, context_tokens = _pack(retrieve(query, documents, top_k), context_token_budget, max_doc_tokens)
+    answer_stream = stream_chat_with_gpt(query, top_docs, completion_model, cache=completion_cache)
+    return StreamingRagResponse(query, top_docs, answer_stream, attributer, executor, context_tokens)
+
+
 if __name__ == "__main__":
     from jsonargparse import CLI
 
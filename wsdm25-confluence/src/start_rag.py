@@ -1,13 +1,29 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import Optional
 from attribution import Attribution
 from preprocessing.embedding import get_openai_api_key, load_documents
-from rag import rag
+from preprocessing.knn_graph import KnnGraph
+from rag import rag_stream
 from utils import display_retrieved_docs
 
 
+def print_attribution(turn: int, question: str, future: Future):
+    if future.cancelled():
+        return
+    if future.exception():
+        print(f"\n=== Attribution of question #{turn} failed: {question} ===\n{future.exception()}\n\n")
+    else:
+        print(f"\n=== Attribution of question #{turn}: {question} ===\n{future.result()}\n\n")
+
+
 def main(
     completion_model: str = "gpt-4o",
     top_k: int = 10,
+    attribution_workers: int = 2,
+    context_token_budget: Optional[int] = None,
+    max_doc_tokens: Optional[int] = None,
 ):
 
     get_openai_api_key()
@@ -16,28 +32,44 @@ def main(
         raise ValueError("Embedded documents file is missing, or documents")
 
     print(f"{len(documents)} evidences have been loaded.")
-    attributer = Attribution(completion_model)
+    attributer = Attribution(completion_model, knn_graph=KnnGraph.load(embedded_documents_file.parent))
     print(f"Attributer has been loaded with {attributer.model_name}")
+    # Attributions run in the background and are printed once they are ready
+    executor = ThreadPoolExecutor(max_workers=attribution_workers)
 
     print("💬 Type your questions below.")
     print("🚪 Type 'exit' or 'quit' to leave the chatbot.")
 
+    turn = 0
     while True:
         question = input("You: ").strip()
         if question.lower() in {"exit", "quit"}:
             print("👋 Exiting the chatbot. Goodbye!")
+            executor.shutdown(wait=True, cancel_futures=True)
+            attributer.close()
             break
 
-        rag_response = rag(
+        turn += 1
+        rag_response = rag_stream(
             query=question,
             attributer=attributer,
             documents=documents,
             top_k=top_k,
             completion_model=completion_model,
+            executor=executor,
+            context_token_budget=context_token_budget,
+            max_doc_tokens=max_doc_tokens,
         )
+        # The sources are shown right away, the answer is printed while it is generated
         display_retrieved_docs(rag_response, top_k)
-        print(f"\n💡 Answer: {rag_response.answer}\n")
-        print(f"=== Attribution ===\n{rag_response.attribution}\n\n")
+        if rag_response.context_tokens is not None:
+            print(f"📦 {len(rag_response.retrieved_docs)} evidences packed into ~{rag_response.context_tokens} tokens")
+        print("\n💡 Answer: ", end="", flush=True)
+        for text in rag_response:
+            print(text, end="", flush=True)
+        print("\n")
+        # Attributions may finish out of order, so each one is printed with its question
+        rag_response.attribution_future.add_done_callback(partial(print_attribution, turn, question))
 
 
 if __name__ == "__main__":
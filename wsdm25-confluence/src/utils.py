@@ -1,31 +1,217 @@
-from typing import List
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from openai.types.chat import ChatCompletionMessage
+from completion_cache import CompletionCache
 from preprocessing.embedding import Document
+from preprocessing.utils import estimate_tokens
 
 
-def chat_with_gpt(
-    query: str, context_docs: List[Document], model: str = "gpt-4"
-) -> ChatCompletionMessage:
-    client = OpenAI()
-
+def build_prompt(query: str, context_docs: List[Document], mask: Optional[List[bool]] = None) -> str:
+    """
+    Builds the RAG prompt. Documents whose `mask` entry is True are listed with empty content,
+    which is how counterfactual prompts leave out evidences without copying the documents.
+    """
     prompt = """
             You are a helpful assistant. You are specialized in answering conversational questions in a retrieval-augmented generation (RAG) setup. Please provide as precise and concise an answer to the input question as possible (less than 50 words if possible), using the retrieved evidences in this prompt as sources for answering. There is no need to provide additional information beyond the requested answer, and also no need for supporting explanations. If the requested information cannot be found in the provided evidences, please state exactly: "The desired information cannot be found in the retrieved pool of evidence." Please use only the information presented in the evidences, and mark the sources used in your answering within square brackets, like [Source 2] or [Source 5]. Please do not use your parametric memory and world knowledge.
             """
-    for doc in context_docs:
-        prompt += f"- {doc.title}: {doc.content}\n\n"
+    for idx, doc in enumerate(context_docs):
+        content = "" if mask and mask[idx] else doc.content
+        prompt += f"- {doc.title}: {content}\n\n"
     prompt += f"QUERY: {query}\n"
+    return prompt
+
+
+@dataclass
+class PackedContext:
+    documents: List[Document]
+    num_tokens: int  # Estimated tokens of the packed evidences in the prompt
+    truncated_ids: List[str] = field(default_factory=list)
+    dropped_ids: List[str] = field(default_factory=list)  # Duplicates and evidences that did not fit
+
+
+def _evidence_tokens(doc: Document) -> int:
+    return estimate_tokens(f"- {doc.title}: {doc.content}\n\n")
+
+
+def _truncate_content(content: str, max_tokens: int) -> str:
+    """ Cuts the content to about `max_tokens` at the last word boundary before the limit. """
+    max_length = max(0, max_tokens * 4 - len(" ..."))  # Same 4 chars per token as `estimate_tokens`
+    if len(content) <= max_length:
+        return content
+    cut = content.rfind(" ", 0, max_length + 1)
+    return content[:cut if cut > 0 else max_length].rstrip() + " ..."
+
+
+def pack_evidences(
+    context_docs: List[Document],
+    token_budget: Optional[int],
+    max_doc_tokens: Optional[int] = None,
+    min_doc_tokens: int = 32,
+) -> PackedContext:
+    """
+    Packs the evidences into a prompt budget of about `token_budget` tokens (None for no budget).
+
+    The evidences are ordered by retrieval score (retrieval order on ties). Evidences with the same title and content
+    as an earlier one are dropped. Every evidence is cut to `max_doc_tokens`, e.g. to keep a single large table from
+    taking up the budget. An evidence that does not fit is cut to the rest of the budget if at least `min_doc_tokens`
+    are left for its content next to its title, and dropped otherwise.
+    The packing is deterministic, so the answer and its counterfactual answers (see `Attribution`) are generated on
+    the same context when it is packed once and passed to both.
+    """
+    packed = PackedContext(documents=[], num_tokens=0)
+    seen = set()
+    for doc in sorted(context_docs, key=lambda doc: -doc.score):
+        if (doc.title, doc.content) in seen:
+            packed.dropped_ids.append(doc.id)
+            continue
+        seen.add((doc.title, doc.content))
+
+        remaining = token_budget - packed.num_tokens if token_budget is not None else None
+        max_tokens = min((limit for limit in (remaining, max_doc_tokens) if limit is not None), default=None)
+        if max_tokens is not None and _evidence_tokens(doc) > max_tokens:
+            content_tokens = max_tokens - _evidence_tokens(doc.model_copy(update={"content": ""}))
+            if content_tokens < min_doc_tokens:
+                packed.dropped_ids.append(doc.id)
+                continue
+            doc = doc.model_copy(update={"content": _truncate_content(doc.content, content_tokens)})
+            packed.truncated_ids.append(doc.id)
+
+        packed.documents.append(doc)
+        packed.num_tokens += _evidence_tokens(doc)
+    return packed
+
+
+def chat_with_gpt(
+    query: str,
+    context_docs: List[Document],
+    model: str = "gpt-4",
+    mask: Optional[List[bool]] = None,
+    temperature: float = 0.7,
+    cache: Optional[CompletionCache] = None,
+) -> ChatCompletionMessage:
+    """
+    Answers the query on the context documents. With a `cache`, identical prompts are answered from it
+    (see `CompletionCache`).
+    """
+    prompt = build_prompt(query, context_docs, mask)
+    max_tokens = 300
+    if cache is not None:
+        content = cache.complete(
+            model, temperature, max_tokens, prompt,
+            lambda: chat_with_gpt(query, context_docs, model, mask, temperature).content,
+        )
+        return ChatCompletionMessage(role="assistant", content=content)
+
+    client = OpenAI()
 
     completion = client.chat.completions.create(
         model=model,
         messages=[{"role": "user", "content": prompt}],
-        temperature=0.7,
-        max_tokens=300,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+    return completion.choices[0].message
+
+
+def stream_chat_with_gpt(
+    query: str,
+    context_docs: List[Document],
+    model: str = "gpt-4",
+    mask: Optional[List[bool]] = None,
+    temperature: float = 0.7,
+    cache: Optional[CompletionCache] = None,
+) -> Iterator[str]:
+    """
+    Same as `chat_with_gpt`, but yields the answer text piece by piece while it is generated.
+    A cached answer is yielded at once.
+    """
+    prompt = build_prompt(query, context_docs, mask)
+    max_tokens = 300
+    if cache is not None:
+        yield from cache.stream(
+            model, temperature, max_tokens, prompt,
+            lambda: stream_chat_with_gpt(query, context_docs, model, mask, temperature),
+        )
+        return
+
+    client = OpenAI()
+
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def async_chat_with_gpt(
+    query: str,
+    context_docs: List[Document],
+    model: str = "gpt-4",
+    client: Optional[AsyncOpenAI] = None,
+    mask: Optional[List[bool]] = None,
+    temperature: float = 0.7,
+    cache: Optional[CompletionCache] = None,
+) -> ChatCompletionMessage:
+    """
+    Same as `chat_with_gpt`, but awaitable. Pass a shared `client` when issuing several requests concurrently,
+    otherwise a new client is created (and closed) for this request.
+    """
+    if client is None:
+        async with AsyncOpenAI() as client:
+            return await async_chat_with_gpt(query, context_docs, model, client, mask, temperature, cache)
+
+    prompt = build_prompt(query, context_docs, mask)
+    max_tokens = 300
+    if cache is not None:
+        async def generate() -> str:
+            return (await async_chat_with_gpt(query, context_docs, model, client, mask, temperature)).content
+
+        content = await cache.acomplete(model, temperature, max_tokens, prompt, generate)
+        return ChatCompletionMessage(role="assistant", content=content)
+
+    completion = await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+        max_tokens=max_tokens,
     )
     return completion.choices[0].message
 
 
+class RateLimiter:
+    """
+    Spaces out requests to at most `requests_per_minute`, shared across threads and event loops.
+    """
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """ Reserves the next free slot and returns the seconds until it. """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+    def wait(self):
+        time.sleep(self._reserve())
+
+    async def async_wait(self):
+        await asyncio.sleep(self._reserve())
+
+
 def display_retrieved_docs(rag_response, top_k=5):
     print(f"\n=== 🔍 Top {top_k} Retrieved Evidences ===\n")
 
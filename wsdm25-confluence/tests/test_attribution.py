@@ -0,0 +1,67 @@
+import asyncio
+from typing import List, Optional
+
+import numpy as np
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletionMessage
+
+from attribution import Attribution, masked_softmax
+from models.data import Document
+
+ANSWER = "OpenXT runs on the Xen hypervisor [Source 1] [Source 2]."
+
+
+class FakeAttribution(Attribution):
+    """ Answers are the evidences left in the prompt; removing evidence `idx` changes the answer by `changes[idx]`. """
+    def __init__(self, changes: List[float]):
+        super().__init__(model_name="fake")
+        self.changes = changes
+        self.embedded_texts = []
+
+    async def _generate_answers(self, question: str, evidences: List[Document], masks: List[List[bool]],
+                                client: Optional[AsyncOpenAI] = None) -> List[ChatCompletionMessage]:
+        return [
+            ChatCompletionMessage(role="assistant", content=",".join(str(idx) for idx, masked in enumerate(mask) if masked))
+            for mask in masks
+        ]
+
+    async def _evaluate_answers(self, answer: str, counterfactual_answers: List[str],
+                                client: Optional[AsyncOpenAI] = None) -> np.ndarray:
+        return np.array([sum(self.changes[int(idx)] for idx in removed.split(",")) for removed in counterfactual_answers])
+
+    async def _request_embeddings(self, texts: List[str], client: Optional[AsyncOpenAI] = None) -> List[np.ndarray]:
+        # Only the answer is similar to itself, so no evidence is supported by its embedding
+        self.embedded_texts.extend(texts)
+        return [np.array([1.0, 0.0]) if text == ANSWER else np.array([0.0, 1.0]) for text in texts]
+
+
+def _citation_scores(changes: List[float]) -> np.ndarray:
+    evidences = [
+        # Cited and supported
+        Document(id="1", title="", url="", content="OpenXT runs on the Xen hypervisor."),
+        # Cited, but not supported: ambiguous
+        Document(id="2", title="", url="", content="Meeting notes of the release planning."),
+        # Neither cited nor supported
+        Document(id="3", title="", url="", content="A page about something else."),
+    ]
+    attributer = FakeAttribution(changes)
+    scores, cf_results = asyncio.run(attributer._citation_attributions("question", evidences, ANSWER, [[0], [1], [2]]))
+    # The evidences are embedded with the shared (async) requests, not with a client of their own
+    assert attributer.embedded_texts == [ANSWER] + [evidence.content for evidence in evidences]
+    assert cf_results[0].answer_counterfactual == ""
+    assert cf_results[1].attributed_evidences == [1]
+    return scores
+
+
+def test_citation_scores_of_cited_and_ambiguous_clusters_are_dissimilarities():
+    scores = _citation_scores([0.0, 0.1, 0.0])
+    # The ambiguous cluster is scored with its counterfactual, the cited one on the same scale (and higher)
+    assert scores.tolist() == [0.3, 0.1, 0.0]
+    probabilities = masked_softmax(scores)
+    assert probabilities[0] > probabilities[1] > 0
+    assert probabilities[2] == 0
+
+
+def test_cited_clusters_score_at_least_the_largest_dissimilarity():
+    scores = _citation_scores([0.0, 0.5, 0.0])
+    assert scores.tolist() == [0.5, 0.5, 0.0]
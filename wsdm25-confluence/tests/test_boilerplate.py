@@ -0,0 +1,39 @@
+from models.data import Document
+from preprocessing.heterogenous_data.boilerplate import BoilerplateDetector, line_template
+
+OWNERS = ["Jane Doe", "John Roe", "Ross Philipson", "Christopher Clark"]
+DATES = ["May 19, 2016", "Oct 04, 2016", "Sep 25, 2015", "Jul 27, 2014"]
+
+
+def _documents():
+    return [
+        Document(id=str(idx), title="", url="", content=(
+            f'<div><p>Owned by <a href="/users/{idx}">{owner}</a></p>'
+            f'<p>Last updated: {date} by {owner}</p>'
+            f'<p>Page {idx} explains how to build the <b>OpenXT</b> installer.</p></div>'
+        ))
+        for idx, (owner, date) in enumerate(zip(OWNERS, DATES))
+    ]
+
+
+def test_line_template():
+    assert line_template("Last updated:  May 19, 2016 by Christopher Clark") == "Last updated: <DATE> by <NAME>"
+
+
+def test_strips_variants_of_templated_lines():
+    detector = BoilerplateDetector(min_documents=3).fit(_documents())
+    assert "Owned by <NAME>" in detector.templates
+    assert "Last updated: <DATE> by <NAME>" in detector.templates
+
+    # Neither the combination of owner and date nor the owner on its own line was seen
+    text = "Last updated: Jan 02, 2020 by Jane Doe\nThe installer needs a build machine.\nOwned by Max Mustermann"
+    stripped_text, stripped = detector.strip(text)
+    assert stripped_text == "The installer needs a build machine."
+    assert stripped == ["Last updated: Jan 02, 2020 by Jane Doe", "Owned by Max Mustermann"]
+
+
+def test_keeps_words_following_a_name():
+    detector = BoilerplateDetector(min_documents=3).fit(_documents())
+    stripped_text, stripped = detector.strip("Owned by Ross Philipson Build Instructions for the installer")
+    assert stripped_text == "Build Instructions for the installer"
+    assert stripped == ["Owned by Ross Philipson"]